@@ -1,15 +1,32 @@
 #!/usr/bin/python3
 
 import argparse
+import sys
 import math
 import re
 import io
+import collections
+import bisect
+import itertools
+import heapq
+import contextlib
+import hashlib
+import os
+import gc
+import pickle
+import zlib
+import concurrent.futures
+import tempfile
 import png
+import numpy as np
 from subprocess import Popen, PIPE
+from time import perf_counter
 
 
 resolution = 100
 debug = False
+debug_cache = False
+revision = 0
 
 
 def error(message):
@@ -17,6 +34,11 @@ def error(message):
     raise ValueError
 
 
+def modified():
+    global revision
+    revision += 1
+
+
 class Labels():
     def __init__(self, labels_files=[]):
         self.labels = {}
@@ -103,12 +125,36 @@ class Labels():
 
 
 class Color():
+    __slots__ = ('red', 'green', 'blue')
     amplify_table = list(int(math.sqrt(i / 255) * 255) for i in range(256))
+    amplify_array = np.array(amplify_table, dtype=np.uint8)
+    interned = {}
+    interned_max = 4096
 
+    # instances are shared between commands and caches, so they can not be modified after creation
     def __init__(self, red=0, green=0, blue=0):
-        self.red = red
-        self.green = green
-        self.blue = blue
+        _set_red(self, red)
+        _set_green(self, green)
+        _set_blue(self, blue)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'can not set \'{name}\' of immutable Color')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'can not delete \'{name}\' of immutable Color')
+
+    def __reduce__(self):
+        return Color, (self.red, self.green, self.blue)
+
+    @classmethod
+    def intern(cls, red=0, green=0, blue=0):
+        key = (red, green, blue)
+        color = cls.interned.get(key)
+        if color is None:
+            color = cls(red, green, blue)
+            if len(cls.interned) < cls.interned_max:
+                cls.interned[key] = color
+        return color
 
     def __repr__(self):
         return "Color({}, {}, {})".format(self.red, self.green, self.blue)
@@ -131,13 +177,25 @@ class Color():
     def __eq__(self, other):
         return (self.red == other.red and self.green == other.green and self.blue == other.blue)
 
+    def __hash__(self):
+        return hash((self.red, self.green, self.blue))
+
     def __or__(self, other):
+        if self.red is not None and self.green is not None and self.blue is not None:
+            return self
         return Color(
             self.red if self.red is not None else other.red,
             self.green if self.green is not None else other.green,
             self.blue if self.blue is not None else other.blue
         )
 
+    def interpolate(self, other, factor):
+        return Color(
+            self.red * (1 - factor) + other.red * factor,
+            self.green * (1 - factor) + other.green * factor,
+            self.blue * (1 - factor) + other.blue * factor
+        )
+
     def distance(self, other):
         return round(math.sqrt(pow(self.red - other.red, 2) + pow(self.green - other.green, 2) + pow(self.blue - other.blue, 2)), 4)
 
@@ -148,72 +206,304 @@ class Color():
             return (self.red, self.green, self.blue)
 
 
+_set_red, _set_green, _set_blue = Color.red.__set__, Color.green.__set__, Color.blue.__set__
+
+for rgb in itertools.product((0, 255), repeat=3):
+    Color.intern(*rgb)
+
+
 class ColorList(list):
     def get_rgb(self, amplify=False):
         return list(c.get_rgb(amplify) for c in self)
 
 
+class SegmentList(list):
+    def append_hold(self, start, duration, color):
+        if duration > 0:
+            if len(self) > 0:
+                (s_start, s_duration, s_from, s_to) = self[-1]
+                if s_start + s_duration == start and s_from == color and s_to == color:
+                    self[-1] = (s_start, s_duration + duration, color, color)
+                    return
+            self.append((start, duration, color, color))
+
+    def append_ramp(self, start, duration, color_from, color_to):
+        if duration > 0:
+            self.append((start, duration, color_from, color_to))
+
+    def extend_shifted(self, segments, shift):
+        for (start, duration, color_from, color_to) in segments:
+            if color_from == color_to:
+                self.append_hold(start + shift, duration, color_from)
+            else:
+                self.append_ramp(start + shift, duration, color_from, color_to)
+
+    def get_duration(self):
+        if len(self) == 0:
+            return 0
+        return self[-1][0] + self[-1][1]
+
+    def render_array(self, amplify=False):
+        array = np.zeros((self.get_duration(), 3), dtype=np.uint8)
+        for (start, duration, color_from, color_to) in self:
+            if color_from == color_to:
+                array[start: start + duration] = color_from.get_rgb()
+            else:
+                array[start: start + duration] = LightCommandRamp._interpolate(color_from, color_to, duration)
+        if amplify:
+            return Color.amplify_array[array]
+        return array
+
+
 class Arguments():
+    # bumped on every in-place change, also invalidates arguments using a changed constant
+    revision = 0
+    _values = None
+    _values_revision = None
+
     def __init__(self, objects, name=None):
         self.objects = objects
         self.name = name
+        self._values = None
+        self._values_revision = None
 
     def __hash__(self):
-        return hash(tuple(self._expand()))
+        return hash(self._get_values())
 
     def __eq__(self, other):
-        return self._expand() == other._expand()
+        return self._get_values() == other._get_values()
 
     def __str__(self):
         if self.name is not None:
             return self.name
         return ", ".join(map(str, self.objects))
 
-    def _expand(self):
-        values = []
-        for o in self.objects:
-            if isinstance(o, Arguments):
-                values.extend(o._expand())
-            elif isinstance(o, list):
-                values.extend(o)
+    def _get_values(self):
+        if self._values_revision != Arguments.revision:
+            if any(isinstance(o, (Arguments, list)) for o in self.objects):
+                values = []
+                for o in self.objects:
+                    if isinstance(o, Arguments):
+                        values.extend(o._get_values())
+                    elif isinstance(o, list):
+                        values.extend(o)
+                    else:
+                        values.append(o)
+                self._values = tuple(values)
             else:
-                values.append(o)
-        return values
+                self._values = tuple(self.objects)
+            self._values_revision = Arguments.revision
+        return self._values
+
+    def _expand(self):
+        return list(self._get_values())
 
     def __len__(self):
-        return len(self._expand())
+        return len(self._get_values())
 
     def __getitem__(self, key):
-        return self._expand()[key]
+        return self._get_values()[key]
+
+    def __iter__(self):
+        return iter(self._get_values())
+
+    def __getstate__(self):
+        # cached values are only valid within this process
+        return {'objects': self.objects, 'name': self.name}
 
     def __setitem__(self, key, value):
         self.objects[key] = value
+        Arguments.revision += 1
+        modified()
+
+
+class RenderCache():
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        # names of the subs worth caching, all if None
+        self.names = None
+        self.revision = revision
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _validate(self):
+        # any change of the tree invalidates all entries
+        if self.revision != revision:
+            self.entries.clear()
+            self.revision = revision
+
+    def get(self, key):
+        self._validate()
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._validate()
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def release(self):
+        # drops the entries but keeps the statistics
+        self.entries.clear()
+        self.names = None
+
+    def clear(self):
+        self.release()
+        self.hits = 0
+        self.misses = 0
+
+
+class TimeIndex():
+    def __init__(self, root):
+        self.root = root
+        self.revision = revision
+        self.sequences = {}
+
+    def lookup(self, sequence):
+        # start ticks and accumulated color changes of the children
+        if self.revision != revision:
+            self.sequences.clear()
+            self.revision = revision
+        if id(sequence) not in self.sequences:
+            starts = [0]
+            changes = [Color.intern(None, None, None)]
+            for o in sequence:
+                starts.append(starts[-1] + o.get_duration(self.root))
+                changes.append(o._color_change(self.root) | changes[-1])
+            self.sequences[id(sequence)] = (sequence, starts, changes)
+        return self.sequences[id(sequence)][1:]
+
+
+class FileCache():
+    suffix = '.glo-cache'
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # entries are unpickled, anyone who can write them could run code
+        stat = os.stat(directory)
+        if hasattr(os, 'getuid') and (stat.st_uid != os.getuid() or stat.st_mode & 0o022):
+            error(f'cache directory \'{directory}\' must be owned by the current user and not writable by others')
+        # entries of another version of aeropy or module name can not be loaded
+        with open(__file__, 'rb') as f:
+            self.version = hashlib.sha256(f.read() + __name__.encode()).digest()
+
+    def key(self, filename, split_number):
+        h = hashlib.sha256(self.version)
+        h.update(repr(split_number).encode())
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _entries(self):
+        return [os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith(self.suffix)]
+
+    def get(self, key):
+        # the collector would scan the growing tree over and over while loading
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(self._path(key), 'rb') as f:
+                value = pickle.loads(zlib.decompress(f.read()))
+        except (OSError, EOFError, zlib.error, pickle.UnpicklingError, AttributeError, ImportError, ValueError, KeyError, IndexError, TypeError):
+            return None
+        finally:
+            if gc_enabled:
+                gc.enable()
+        # the modification time orders the entries for eviction, the entry might just have been evicted by another process
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            return None
+        return value
+
+    def put(self, key, value):
+        # every writer has its own temporary file, the entry appears at once
+        fd, path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+            os.replace(path, self._path(key))
+        except BaseException:
+            os.remove(path)
+            raise
+        self._evict()
+
+    def _evict(self):
+        # other processes might evict the same entries at the same time
+        entries = []
+        for entry in self._entries():
+            try:
+                stat = os.stat(entry)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        entries.sort()
+        size = sum(e[1] for e in entries)
+        for mtime, entry_size, entry in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(entry)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+    def clear(self):
+        print(f'clearing cache \'{self.directory}\'')
+        for entry in self._entries():
+            os.remove(entry)
 
 
 class LightCommand:
     name = None
     command_variants = None
     valid_arguments = ((),)
+    # argument type signatures already found valid, per class
+    valid_signatures = {}
+    # attributes holding derived data only, not pickled
+    transient = ()
 
-    def __init__(self, arguments=[], noop=None):
+    def __init__(self, arguments=[], noop=None, check=True):
         self.arguments = arguments
         self.noop = noop
-        self._check_arguments()
+        if check:
+            self._check_arguments()
 
     def _check_arguments(self):
+        signature = tuple(map(type, self.arguments))
+        signatures = LightCommand.valid_signatures.setdefault(type(self), set())
+        if signature in signatures:
+            return
         if not any(
-            len(self.arguments) == len(self.valid_arguments[n]) and
-            all(
-                isinstance(self.arguments[m], self.valid_arguments[n][m])
-                for m in range(len(self.valid_arguments[n]))
-            )
-            for n in range(len(self.valid_arguments))
+            len(signature) == len(valid) and
+            all(isinstance(a, t) for a, t in zip(self.arguments, valid))
+            for valid in self.valid_arguments
         ):
             error(f'{self.name} has invalid arguments: ({self.arguments})')
+        signatures.add(signature)
 
     def __repr__(self):
         return f'{self.name} ({self.arguments})'
 
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k not in self.transient}
+
     def __hash__(self):
         return hash((self.name, self.arguments))
 
@@ -257,6 +547,33 @@ class LightCommand:
     def render(self, color_pre=Color(), root=None):
         return ColorList(self._render_connected(color_pre, root)[0])
 
+    def _render_array(self, array, offset, color_pre, root):
+        return offset, color_pre
+
+    def render_array(self, color_pre=Color(), root=None, amplify=False):
+        array = np.zeros((self.get_duration(root), 3), dtype=np.uint8)
+        self._render_array(array, 0, color_pre, root)
+        if amplify:
+            return Color.amplify_array[array]
+        return array
+
+    def _render_segments(self, segments, start, color_pre, root):
+        return start, color_pre
+
+    def _render_range(self, array, offset, time_start, time_end, color_pre, root):
+        pass
+
+    def _color_change(self, root):
+        return Color.intern(None, None, None)
+
+    def walk(self):
+        yield self
+
+    def render_segments(self, color_pre=Color(), root=None):
+        segments = SegmentList()
+        self._render_segments(segments, 0, color_pre, root)
+        return segments
+
     def resolve_constants(self):
         if isinstance(self.arguments, Arguments):
             self.arguments = Arguments(self.arguments._expand())
@@ -299,13 +616,13 @@ class LightCommandTime(LightCommand):
             if (time_add > 0):
                 if debug:
                     print(f'{self.name} ({self.arguments}): {time} / {time_ref}+{time_target}{time_target_delta:+}, add: {time_add}')
-                objects.append(LightCommandNoop(noop=f'; TIME SHIFT ({self.arguments}): time={time}, target={time_ref}+{time_target}{time_target_delta:+}, add={time_add}'))
-                objects.append(LightCommandDelay(arguments=Arguments([time_add])))
+                objects.append(LightCommandNoop(noop=f'; TIME SHIFT ({self.arguments}): time={time}, target={time_ref}+{time_target}{time_target_delta:+}, add={time_add}', check=False))
+                objects.append(LightCommandDelay(arguments=Arguments([time_add]), check=False))
             elif (time_add < 0):
                 error(f'target time in the past: time={time}, ref={time_ref}, target={time_target}{time_target_delta:+}, add={time_add} ({self.arguments})')
 
         elif self.arguments[0] == 'setref':
-            objects.append(LightCommandNoop(noop=f'; TIME REFERENCE ({self.arguments}): old={time_ref}, new={time_target}{time_target_delta:+}'))
+            objects.append(LightCommandNoop(noop=f'; TIME REFERENCE ({self.arguments}): old={time_ref}, new={time_target}{time_target_delta:+}', check=False))
             time_ref = time_target + time_target_delta
 
         else:
@@ -351,15 +668,28 @@ class LightCommandDelay(LightCommand):
             colors.append(color_pre)
         return colors, color_pre
 
+    def _render_array(self, array, offset, color_pre, root=None):
+        duration = self.get_duration()
+        array[offset: offset + duration] = color_pre.get_rgb()
+        return offset + duration, color_pre
+
+    def _render_segments(self, segments, start, color_pre, root=None):
+        duration = self.get_duration()
+        segments.append_hold(start, duration, color_pre)
+        return start + duration, color_pre
+
+    def _render_range(self, array, offset, time_start, time_end, color_pre, root=None):
+        array[offset: offset + time_end - time_start] = color_pre.get_rgb()
+
     def _resolve_unsupported(self):
         d = self.get_duration()
         if d > 0 and d <= self.max_duration:
             return [self]
         else:
             noop = f'; DELAY RESOLVE: {self.get_duration()}' + (self.noop or '')
-            commands = [LightCommandNoop(noop=noop)]
+            commands = [LightCommandNoop(noop=noop, check=False)]
             while d > 0:
-                commands.append(LightCommandDelay(arguments=Arguments([min(d, self.max_duration)])))
+                commands.append(LightCommandDelay(arguments=Arguments([min(d, self.max_duration)]), check=False))
                 d -= self.max_duration
             return commands
 
@@ -370,11 +700,20 @@ class LightCommandColor(LightCommand):
     valid_arguments = ((int, int, int),)
 
     def _color(self):
-        return Color(self.arguments[0], self.arguments[1], self.arguments[2])
+        return Color.intern(self.arguments[0], self.arguments[1], self.arguments[2])
 
     def _render_connected(self, color_pre, root=None):
         return [], self._color() | color_pre
 
+    def _render_array(self, array, offset, color_pre, root=None):
+        return offset, self._color() | color_pre
+
+    def _render_segments(self, segments, start, color_pre, root=None):
+        return start, self._color() | color_pre
+
+    def _color_change(self, root):
+        return self._color()
+
 
 class LightCommandColorRed(LightCommandColor):
     name = 'red'
@@ -382,7 +721,7 @@ class LightCommandColorRed(LightCommandColor):
     valid_arguments = ((int,),)
 
     def _color(self):
-        return Color(self.arguments[0], None, None)
+        return Color.intern(self.arguments[0], None, None)
 
 
 class LightCommandColorGreen(LightCommandColor):
@@ -391,7 +730,7 @@ class LightCommandColorGreen(LightCommandColor):
     valid_arguments = ((int,),)
 
     def _color(self):
-        return Color(None, self.arguments[0], None)
+        return Color.intern(None, self.arguments[0], None)
 
 
 class LightCommandColorBlue(LightCommandColor):
@@ -400,7 +739,7 @@ class LightCommandColorBlue(LightCommandColor):
     valid_arguments = ((int,),)
 
     def _color(self):
-        return Color(None, None, self.arguments[0])
+        return Color.intern(None, None, self.arguments[0])
 
 
 class LightCommandRamp(LightCommandColor):
@@ -417,13 +756,36 @@ class LightCommandRamp(LightCommandColor):
         duration = self.get_duration()
         colors = []
         for n in range(duration):
-            colors.append(round(color_pre * (1 - (n / duration)) + color * (n / duration)))
+            colors.append(round(color_pre.interpolate(color, n / duration)))
         return colors, color
 
+    def _render_array(self, array, offset, color_pre, root=None):
+        color = self._color()
+        duration = self.get_duration()
+        if duration > 0:
+            array[offset: offset + duration] = self._interpolate(color_pre, color, duration)
+        return offset + duration, color
+
+    def _render_segments(self, segments, start, color_pre, root=None):
+        color = self._color()
+        duration = self.get_duration()
+        segments.append_ramp(start, duration, color_pre, color)
+        return start + duration, color
+
+    def _render_range(self, array, offset, time_start, time_end, color_pre, root=None):
+        array[offset: offset + time_end - time_start] = self._interpolate(color_pre, self._color(), self.get_duration(), time_start, time_end)
+
+    @staticmethod
+    def _interpolate(color_from, color_to, duration, time_start=0, time_end=None):
+        if time_end is None:
+            time_end = duration
+        factors = (np.arange(time_start, time_end) / duration)[:, np.newaxis]
+        return np.round(np.array(color_from.get_rgb()) * (1 - factors) + np.array(color_to.get_rgb()) * factors)
+
     def _resolve_unsupported(self):
         d = self.get_duration()
         if d == 0:
-            return [LightCommandColor(arguments=Arguments(list(self._color().get_rgb())), noop=(self.noop or '') + ' ; RESOLVED')]
+            return [LightCommandColor(arguments=Arguments(list(self._color().get_rgb())), noop=(self.noop or '') + ' ; RESOLVED', check=False)]
         elif d <= self.max_duration:
             return [self]
         else:
@@ -438,13 +800,43 @@ class LightCommandSub(LightCommand):
     def get_duration(self, root=None):
         if root is None:
             error('no root')
-        return root.get_sub(self.arguments[0]).get_duration(root)
+        return root.get_sub_duration(self.arguments[0])
 
     def _render_connected(self, color_pre, root=None):
         if root is None:
             error('no root')
         return root.get_sub(self.arguments[0])._render_connected(color_pre, root)
 
+    def _render_array(self, array, offset, color_pre, root=None):
+        if root is None:
+            error('no root')
+        if root.sub_cache.names is not None and self.arguments[0] not in root.sub_cache.names:
+            return root.get_sub(self.arguments[0])._render_array(array, offset, color_pre, root)
+        key = (self.arguments[0], color_pre.get_rgb())
+        cached = root.sub_cache.get(key)
+        if cached is None:
+            end, color = root.get_sub(self.arguments[0])._render_array(array, offset, color_pre, root)
+            root.sub_cache.put(key, (array[offset: end].copy(), color))
+            return end, color
+        colors, color = cached
+        array[offset: offset + len(colors)] = colors
+        return offset + len(colors), color
+
+    def _render_segments(self, segments, start, color_pre, root=None):
+        if root is None:
+            error('no root')
+        return root.get_sub(self.arguments[0])._render_segments(segments, start, color_pre, root)
+
+    def _render_range(self, array, offset, time_start, time_end, color_pre, root=None):
+        if root is None:
+            error('no root')
+        root.get_sub(self.arguments[0])._render_range(array, offset, time_start, time_end, color_pre, root)
+
+    def _color_change(self, root):
+        if root is None:
+            error('no root')
+        return root.get_sub_color_change(self.arguments[0])
+
     def add_namespace(self, namespace):
         self.arguments[0] = namespace + self.arguments[0]
 
@@ -455,26 +847,71 @@ class LightSequence(list, LightCommand):
     valid_arguments = ((),)
     valid_objects = ()
     level_add = 0
-
-    def __init__(self, arguments=[], objects=[], noop=None):
-        self._check_objects(objects)
+    _duration_cache = None
+    transient = ('_duration_cache',)
+    # colors setting single components, their color depends on the color before
+    partial_colors = (LightCommandColorRed, LightCommandColorGreen, LightCommandColorBlue)
+
+    def __init__(self, arguments=[], objects=[], noop=None, check=True):
+        if check:
+            self._check_objects(objects)
         list.__init__(self, objects)
-        LightCommand.__init__(self, arguments=arguments, noop=noop)
+        LightCommand.__init__(self, arguments=arguments, noop=noop, check=check)
 
     def __hash__(self):
         return hash(tuple([LightCommand.__hash__(self)] + list(map(hash, self))))
 
-    def append(self, item):
-        self._check_object(item)
+    def __eq__(self, other):
+        return LightCommand.__eq__(self, other) and list.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def _modified(self):
+        modified()
+
+    def append(self, item, check=True):
+        if check:
+            self._check_object(item)
         list.append(self, item)
+        self._modified()
 
-    def extend(self, items):
-        self._check_objects(items)
+    def extend(self, items, check=True):
+        if check:
+            self._check_objects(items)
         list.extend(self, items)
+        self._modified()
 
-    def insert(self, index, item):
-        self._check_object(item)
+    def insert(self, index, item, check=True):
+        if check:
+            self._check_object(item)
         list.insert(self, index, item)
+        self._modified()
+
+    def pop(self, index=-1):
+        item = list.pop(self, index)
+        self._modified()
+        return item
+
+    def remove(self, item):
+        list.remove(self, item)
+        self._modified()
+
+    def clear(self):
+        list.clear(self)
+        self._modified()
+
+    def __setitem__(self, key, value):
+        list.__setitem__(self, key, value)
+        self._modified()
+
+    def __delitem__(self, key):
+        list.__delitem__(self, key)
+        self._modified()
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
 
     def valid_objects_dict(self):
         command_dict = {}
@@ -488,15 +925,29 @@ class LightSequence(list, LightCommand):
 
     def _check_object(self, item):
         if not isinstance(item, self.valid_objects):
-            error(f'object \'{object.name}\' not allowed in \'{self.name}\'')
+            error(f'object \'{item.name}\' not allowed in \'{self.name}\'')
 
     def _check_objects(self, items):
         for item in items:
             self._check_object(item)
 
     def get_duration(self, root=None):
+        cache = self._duration_cache
+        if cache is not None and cache[0] == revision and cache[1] is root:
+            if debug_cache:
+                self._check_cache('duration', cache[2], self._get_duration(root))
+            return cache[2]
+        duration = self._get_duration(root)
+        self._duration_cache = (revision, root, duration)
+        return duration
+
+    def _get_duration(self, root):
         return sum(object.get_duration(root) for object in self)
 
+    def _check_cache(self, what, cached, value):
+        if cached != value:
+            error(f'cached {what} of \'{self.name}\' is {cached}, recomputed {value}')
+
     def _export(self, indent=0, syntax=[]):
         lines = super()._export(indent, syntax)
         for o in self:
@@ -511,41 +962,109 @@ class LightSequence(list, LightCommand):
             colors.extend(o_colors)
         return colors, color_pre
 
+    def _render_array(self, array, offset, color_pre, root=None):
+        for o in self:
+            offset, color_pre = o._render_array(array, offset, color_pre, root)
+        return offset, color_pre
+
+    def _render_segments(self, segments, start, color_pre, root=None):
+        for o in self:
+            start, color_pre = o._render_segments(segments, start, color_pre, root)
+        return start, color_pre
+
+    def _render_range(self, array, offset, time_start, time_end, color_pre, root=None):
+        starts, changes = root.time_index.lookup(self)
+        index = bisect.bisect_right(starts, time_start) - 1
+        while index < len(self) and starts[index] < time_end:
+            o_start = max(time_start, starts[index])
+            o_end = min(time_end, starts[index + 1])
+            if o_end > o_start:
+                o_offset = offset + o_start - time_start
+                self[index]._render_range(array, o_offset, o_start - starts[index], o_end - starts[index], changes[index] | color_pre, root)
+            index += 1
+
+    def _color_change(self, root):
+        change = Color.intern(None, None, None)
+        for o in self:
+            change = o._color_change(root) | change
+        return change
+
+    # the recursive passes are split into the work on the children of a single sequence,
+    # which is also used by the visitors of the pass manager, and returns the number of changes
+
     def resolve_constants(self):
+        for o in self:
+            if isinstance(o, LightSequence):
+                o.resolve_constants()
+        self._resolve_constants_children()
+
+    def _resolve_constants_children(self):
+        changed = 0
         LightCommand.resolve_constants(self)
         for index in range(len(self)):
             if isinstance(self[index], LightCommandDefine):
                 self[index] = LightCommandNoop(noop=";" + self[index].export())
-            else:
+                changed += 1
+            elif not isinstance(self[index], LightSequence):
+                if isinstance(self[index].arguments, Arguments) and any(isinstance(a, (Arguments, list)) for a in self[index].arguments.objects):
+                    changed += 1
                 self[index].resolve_constants()
+        return changed
 
     def _resolve_unsupported(self):
         self.resolve_unsupported()
+        return self._resolved()
+
+    def _resolved(self):
+        # replacement of this sequence once its children are resolved
         return [self]
 
     def resolve_unsupported(self):
-        index = 0
-        while index < len(self):
-            resolved = self.pop(index)._resolve_unsupported()
-            for r in resolved:
-                self.insert(index, r)
-                index += 1
+        for o in self:
+            if isinstance(o, LightSequence):
+                o.resolve_unsupported()
+        self._resolve_unsupported_children()
+
+    def _resolve_unsupported_children(self):
+        changed = 0
+        objects = []
+        for o in self:
+            resolved = o._resolved() if isinstance(o, LightSequence) else o._resolve_unsupported()
+            if len(resolved) != 1 or resolved[0] is not o:
+                changed += 1
+            objects.extend(resolved)
+        self[:] = objects
+        return changed
 
     def add_namespace(self, namespace):
         super().add_namespace(namespace)
         for o in self:
             o.add_namespace(namespace)
 
+    def walk(self):
+        yield self
+        for o in self:
+            yield from o.walk()
+
     def strip(self):
         for o in self:
-            o.strip()
+            if isinstance(o, LightSequence):
+                o.strip()
+        self._strip_children()
 
-        index = 0
-        while index < len(self):
-            if isinstance(self[index], LightCommandNoop):
-                self.pop(index)
-            else:
-                index += 1
+    def _strip_children(self):
+        changed = 0
+        for o in self:
+            if not isinstance(o, LightSequence):
+                if o.noop is not None and not isinstance(o, LightCommandNoop):
+                    changed += 1
+                o.strip()
+
+        objects = [o for o in self if not isinstance(o, LightCommandNoop)]
+        if len(objects) != len(self):
+            changed += len(self) - len(objects)
+            self[:] = objects
+        return changed
 
     def compress(self, options):
         for o in self:
@@ -556,109 +1075,142 @@ class LightSequence(list, LightCommand):
         if old_len != len(self):
             print(f'compressed adjacent delays (old length: {old_len}, new length: {len(self)})')
 
-        if len(self) > 2 and isinstance(self[0], (LightCommandColor, LightCommandRamp)) and all(isinstance(o, (LightCommandDelay, LightCommandColor, LightCommandRamp)) for o in self[1:]):
+        if len(self) > 2 and isinstance(self[0], (LightCommandColor, LightCommandRamp)) and all(isinstance(o, (LightCommandDelay, LightCommandColor, LightCommandRamp)) and not isinstance(o, self.partial_colors) for o in self):
             self._convert_to_ramps()
             old_len = len(self)
-            self._compress_douglas_peucker(0, len(self) - 1, options['epsilon'])
+            if options.get('ramp_algorithm') == 'greedy':
+                e_max = self._compress_ramp_fit(options['epsilon'])
+            else:
+                e_max = self._compress_douglas_peucker(0, len(self) - 1, options['epsilon'])
             if old_len != len(self):
-                print(f'compressed ramp sequence (old length: {old_len}, new length: {len(self)}, epsilon: {options["epsilon"]})')
+                print(f'compressed ramp sequence (old length: {old_len}, new length: {len(self)}, epsilon: {options["epsilon"]}, max error: {e_max:.2f})')
             self._convert_from_ramps()
 
         if len(self) > 2 and all(isinstance(o, (LightCommandDelay, LightCommandColor, LightCommandRamp, LightCommandSub)) for o in self):
             old_len = len(self)
-            self._compress_repeat(options['root'])
+            if options.get('algorithm') == 'repair':
+                self._compress_repair(options['root'])
+            else:
+                self._compress_repeat(options['root'])
             if old_len != len(self):
                 print(f'compressed repetitions (old length: {old_len}, new length: {len(self)})')
 
     def _compress_adjacent_delays(self):
-        index = 0
-        while index < len(self):
-            if isinstance(self[index], LightCommandDelay):
-                c = 1
-                while index + c < len(self) and isinstance(self[index + c], (LightCommandDelay, LightCommandNoop)):
-                    if isinstance(self[index + c], LightCommandDelay):
-                        arguments = Arguments([self[index].get_duration() + self[index + c].get_duration()])
-                        noop = (self[index].noop or '') + (self[index + c].noop or '')
-                        self[index + c] = LightCommandDelay(arguments=arguments, noop=noop)
-                        self.pop(index)
-                        index += c - 1
-                        c = 1
-                    else:
-                        c += 1
-            index += 1
+        # delays separated by comments only are merged into the last one
+        objects = []
+        delay = None
+        for o in self:
+            if isinstance(o, LightCommandDelay):
+                if delay is not None:
+                    d = objects.pop(delay)
+                    o = LightCommandDelay(arguments=Arguments([d.get_duration() + o.get_duration()]), noop=(d.noop or '') + (o.noop or ''), check=False)
+                delay = len(objects)
+            elif not isinstance(o, LightCommandNoop):
+                delay = None
+            objects.append(o)
+        if len(objects) != len(self):
+            self[:] = objects
+
+    def _suffix_array(self, objects):
+        # prefix doubling: sort suffixes by their first 2^k elements until all ranks differ
+        n = len(objects)
+        rank = np.unique(np.array(objects, dtype=np.int64), return_inverse=True)[1].reshape(-1)
+        suffix_array = np.argsort(rank, kind='stable')
+        k = 1
+        while k < n and rank.max() < n - 1:
+            second = np.full(n, -1, dtype=np.int64)
+            second[:n - k] = rank[k:]
+            suffix_array = np.lexsort((second, rank))
+            first, second = rank[suffix_array], second[suffix_array]
+            change = np.concatenate(([0], (first[1:] != first[:-1]) | (second[1:] != second[:-1])))
+            rank = np.empty(n, dtype=np.int64)
+            rank[suffix_array] = np.cumsum(change)
+            k *= 2
+        return suffix_array.tolist(), rank.tolist()
+
+    def _lcp_array(self, objects, suffix_array, rank):
+        # kasai: lcp[i] is the common prefix length of the suffixes suffix_array[i - 1] and suffix_array[i]
+        n = len(objects)
+        lcp = [0] * n
+        h = 0
+        for i in range(n):
+            if rank[i] > 0:
+                j = suffix_array[rank[i] - 1]
+                while i + h < n and j + h < n and objects[i + h] == objects[j + h]:
+                    h += 1
+                lcp[rank[i]] = h
+                if h > 0:
+                    h -= 1
+            else:
+                h = 0
+        return lcp
+
+    def _find_repeats(self, objects):
+        # all ngrams (length 2 to len / 2) occurring more than once, as (length, positions) sorted by
+        # length and first occurence, overlapping occurences removed from left to right
+        n = len(objects)
+        length_max = n // 2
+        repeats = []
+        if length_max < 2:
+            return repeats
+
+        suffix_array, rank = self._suffix_array(objects)
+        lcp = self._lcp_array(objects, suffix_array, rank)
+
+        # every lcp interval holds the ngrams of the lengths above its parent's lcp up to its own lcp,
+        # all of them occur at the positions of the suffixes in the interval
+        stack = [(0, 0)]
+        for i in range(1, n + 1):
+            current = lcp[i] if i < n else 0
+            lower = i - 1
+            while current < stack[-1][0]:
+                length, lower = stack.pop()
+                length_parent = max(current, stack[-1][0])
+                if length_parent < length_max and length >= 2:
+                    positions_all = sorted(suffix_array[lower: i])
+                    for length_ngram in range(max(length_parent + 1, 2), min(length, length_max) + 1):
+                        positions = [positions_all[0]]
+                        for pos in positions_all:
+                            if pos - positions[-1] >= length_ngram:
+                                positions.append(pos)
+                        if len(positions) > 1:
+                            repeats.append((length_ngram, positions))
+            if current > stack[-1][0]:
+                stack.append((current, lower))
+
+        repeats.sort(key=lambda r: (r[0], r[1][0]))
+        return repeats
 
     def _find_repeated_ngrams(self, objects):
-        ngrams = {}
-
-        # keep track of positions for searching
-        pos_search = list(range(len(objects)))
-
-        # store all ngrams and their occurences in dictionary
-        for length in range(2, len(objects) // 2 + 1):
-            if len(pos_search) > 0:
-                n = 0
-                while n < len(pos_search):
-                    pos = pos_search[n]
-                    if pos + length <= len(objects):
-                        ngram = tuple(objects[pos: pos + length])
-                        try:
-                            ngrams[ngram].append(pos)
-                        except KeyError:
-                            ngrams[ngram] = [pos]
-                        n += 1
-                    else:
-                        pos_search.pop(n)
-
-                # exclude positions that got no duplicates so far
-                n = 0
-                while n < len(pos_search):
-                    pos = pos_search[n]
-                    ngram = tuple(objects[pos: pos + length])
-                    if len(ngrams[ngram]) < 2:
-                        pos_search.pop(n)
-                    else:
-                        n += 1
-
-        # remove overlaps
-        for ngram, n_positions in ngrams.items():
-            c = 1
-            while c < len(n_positions):
-                if n_positions[c] - n_positions[c - 1] < len(ngram):
-                    n_positions.pop(c)
-                else:
-                    c += 1
-
-        # remove single occurences
-        ngrams = dict(filter(lambda elem: len(elem[1]) > 1, ngrams.items()))
-
-        return ngrams
+        return {tuple(objects[positions[0]: positions[0] + length]): positions for length, positions in self._find_repeats(objects)}
+
+    def _group_positions(self, length, positions):
+        # adjacent occurences form a group
+        groups = []
+        for p in range(len(positions)):
+            if p > 0 and positions[p] - positions[p - 1] == length:
+                groups[-1].append(positions[p])
+            else:
+                groups.append([positions[p]])
+        return groups
 
     def _find_repeated_ngrams_grouped(self, objects):
-        repeated_ngrams_grouped = {}
-
-        for ngram, positions in self._find_repeated_ngrams(objects).items():
-            repeated_ngrams_grouped[ngram] = []
-            for p in range(len(positions)):
-                if p > 0 and positions[p] - positions[p - 1] == len(ngram):
-                    repeated_ngrams_grouped[ngram][-1].append(positions[p])
-                else:
-                    repeated_ngrams_grouped[ngram].append([positions[p]])
-
-        return repeated_ngrams_grouped
+        return {ngram: self._group_positions(len(ngram), positions) for ngram, positions in self._find_repeated_ngrams(objects).items()}
 
     def _compress_repeat(self, root):
         while True:
-            repeated_ngrams_grouped = self._find_repeated_ngrams_grouped(list(map(hash, self)))
+            hashes = list(map(hash, self))
 
             max_delta = 0
             ngram_hash = None
             ngram_positions_groups = []
 
-            for n_hash, n_positions_groups in repeated_ngrams_grouped.items():
+            for length, positions in self._find_repeats(hashes):
+                n_positions_groups = self._group_positions(length, positions)
 
-                command_decrease = len(n_hash) * sum(len(group) for group in n_positions_groups)
+                command_decrease = length * len(positions)
                 # increase for defsub:
-                command_increase = len(n_hash) + 1
+                command_increase = length + 1
                 for group in n_positions_groups:
                     if len(group) > 1:
                         # increase for loop + sub
@@ -671,7 +1223,7 @@ class LightSequence(list, LightCommand):
 
                 if delta > max_delta:
                     max_delta = delta
-                    ngram_hash = n_hash
+                    ngram_hash = tuple(hashes[positions[0]: positions[0] + length])
                     ngram_positions_groups = n_positions_groups
 
             # create and use subsequence
@@ -684,113 +1236,325 @@ class LightSequence(list, LightCommand):
                     print(f'create subsequence for {positions_total} ({len(ngram_positions_groups)} groups) times repetition (delta = {max_delta}) of: {ngram}')
 
                 arguments = Arguments([f's{hash(ngram_hash) % 1000000:06}'])
-                sub = LightCommandSub(arguments=arguments, noop='; COMPRESSED')
-                ds = LightSequenceDefsub(arguments=arguments, objects=ngram, noop='; COMPRESSED ({})'.format(positions_total))
-                root.append(ds)
+                sub = LightCommandSub(arguments=arguments, noop='; COMPRESSED', check=False)
+                ds = LightSequenceDefsub(arguments=arguments, objects=ngram, noop='; COMPRESSED ({})'.format(positions_total), check=False)
+                root.append(ds, check=False)
 
-                pos_adjust = 0
+                # replace each group of repetitions by a sub in a single sweep
+                objects = []
+                pos = 0
                 for group in ngram_positions_groups:
-                    # remove objects
-                    for p in range(len(group) * ngram_length):
-                        self.pop(group[0] + pos_adjust)
-                    # insert sub
+                    objects.extend(self[pos: group[0]])
                     if len(group) > 1:
-                        loop = LightSequenceLoop(arguments=Arguments([len(group)]), objects=[sub], noop='; COMPRESSED')
-                        self.insert(group[0] + pos_adjust, loop)
+                        objects.append(LightSequenceLoop(arguments=Arguments([len(group)]), objects=[sub], noop='; COMPRESSED', check=False))
                     else:
-                        self.insert(group[0] + pos_adjust, sub)
-                    # adjust position
-                    pos_adjust += 1 - (len(group) * ngram_length)
+                        objects.append(sub)
+                    pos = group[0] + len(group) * ngram_length
+                objects.extend(self[pos:])
+                self[:] = objects
 
             else:
                 return
 
+    def _compress_repair(self, root):
+        # re-pair: replace the most frequent pair of adjacent symbols by a new symbol until no pair
+        # occurs twice, then keep only the rules that pay off with the cost model of _compress_repeat
+        terminals = {}
+        pools = []
+        symbols = []
+        for o in self:
+            if o not in terminals:
+                terminals[o] = len(pools)
+                pools.append(collections.deque())
+            pools[terminals[o]].append(o)
+            symbols.append(terminals[o])
+        hashes = [hash(pool[0]) for pool in pools]
+
+        main, rules = self._repair_rules(symbols, len(pools))
+        self._repair_prune(main, rules)
+
+        expanded = {}
+
+        def expand(symbol):
+            if symbol < len(pools):
+                return (symbol,)
+            if symbol not in expanded:
+                expanded[symbol] = sum((expand(s) for s in rules[symbol]), ())
+            return expanded[symbol]
+
+        names = {}
+
+        def emit(symbols):
+            objects = []
+            for symbol, group in itertools.groupby(symbols):
+                count = len(list(group))
+                if symbol in rules:
+                    sub = LightCommandSub(arguments=Arguments([names[symbol]]), noop='; COMPRESSED', check=False)
+                    if count > 1:
+                        objects.append(LightSequenceLoop(arguments=Arguments([count]), objects=[sub], noop='; COMPRESSED', check=False))
+                    else:
+                        objects.append(sub)
+                elif count > 2:
+                    objects.append(LightSequenceLoop(arguments=Arguments([count]), objects=[pools[symbol].popleft()], noop='; COMPRESSED', check=False))
+                else:
+                    objects.extend(pools[symbol].popleft() for _ in range(count))
+            return objects
+
+        uses = collections.Counter(itertools.chain(main, *rules.values()))
+        shared = {}
+        subs = root._get_subs()
+        for symbol, body in rules.items():
+            # rules with equal expansions share one sub
+            expansion = expand(symbol)
+            if expansion in shared:
+                names[symbol] = names[shared[expansion]]
+                continue
+            shared[expansion] = symbol
+            objects = emit(body)
+
+            # expanded hashes name the subs like _compress_repeat does, other subs with the same name get a suffix
+            base = f's{hash(tuple(hashes[s] for s in expansion)) % 1000000:06}'
+            names[symbol] = base
+            n = 1
+            while names[symbol] in subs and list(subs[names[symbol]]) != objects:
+                n += 1
+                names[symbol] = f'{base}_{n}'
+            if names[symbol] in subs:
+                continue
+            if debug:
+                print(f'create subsequence for {uses[symbol]} times repetition of: {body}')
+            root.append(LightSequenceDefsub(arguments=Arguments([names[symbol]]), objects=objects, noop=f'; COMPRESSED ({uses[symbol]})', check=False), check=False)
+
+        objects = emit(main)
+        self.clear()
+        self.extend(objects, check=False)
+
+    def _repair_rules(self, symbols, symbol_next):
+        # symbols are replaced in place, removed positions are unlinked
+        n = len(symbols)
+        prev = list(range(-1, n - 1))
+        next = list(range(1, n + 1))
+        next[-1] = -1
+        occurrences = collections.defaultdict(set)
+        for i in range(n - 1):
+            occurrences[(symbols[i], symbols[i + 1])].add(i)
+        # runs of a symbol are left for loops
+        heap = [(-len(positions), pair) for pair, positions in occurrences.items() if pair[0] != pair[1]]
+        heapq.heapify(heap)
+        rules = {}
+
+        while heap:
+            count, pair = heapq.heappop(heap)
+            # entries are not updated in place, skip outdated ones
+            if -count != len(occurrences[pair]):
+                continue
+            if -count < 2:
+                break
+
+            symbol = symbol_next
+            symbol_next += 1
+            rules[symbol] = list(pair)
+            changed = set()
+
+            for i in sorted(occurrences[pair]):
+                if i not in occurrences[pair]:
+                    continue
+                j = next[i]
+                p, q = prev[i], next[j]
+                occurrences[pair].discard(i)
+                if p >= 0:
+                    occurrences[(symbols[p], symbols[i])].discard(p)
+                    changed.add((symbols[p], symbols[i]))
+                if q >= 0:
+                    occurrences[(symbols[j], symbols[q])].discard(j)
+                    changed.add((symbols[j], symbols[q]))
+
+                symbols[i] = symbol
+                next[i] = q
+                if q >= 0:
+                    prev[q] = i
+                prev[j] = next[j] = None
+
+                if p >= 0:
+                    occurrences[(symbols[p], symbol)].add(p)
+                    changed.add((symbols[p], symbol))
+                if q >= 0:
+                    occurrences[(symbol, symbols[q])].add(i)
+                    changed.add((symbol, symbols[q]))
+
+            for c in changed:
+                if len(occurrences[c]) > 1 and c[0] != c[1]:
+                    heapq.heappush(heap, (-len(occurrences[c]), c))
+
+        main = []
+        i = 0 if n > 0 else -1
+        while i >= 0:
+            main.append(symbols[i])
+            i = next[i]
+        return main, rules
+
+    def _repair_prune(self, main, rules):
+        # inline rules until every remaining rule saves commands: a rule costs its body, the defsub
+        # and one command per use (two for a loop), inlining costs the body at every use
+        def cost(symbols):
+            total = 0
+            for symbol, group in itertools.groupby(symbols):
+                count = len(list(group))
+                if symbol in rules:
+                    total += 1 if count == 1 else 2
+                else:
+                    total += count if count <= 2 else 2
+            return total
+
+        def inline(symbol, body, symbols):
+            result = []
+            for s in symbols:
+                if s == symbol:
+                    result.extend(body)
+                else:
+                    result.append(s)
+            return result
+
+        changed = True
+        while changed:
+            changed = False
+            for symbol in list(rules):
+                body = rules[symbol]
+                body_cost = cost(body)
+                sites = []
+                for symbols in itertools.chain([main], rules.values()):
+                    sites.extend(len(list(g)) for s, g in itertools.groupby(symbols) if s == symbol)
+                keep = body_cost + 1 + sum(1 if k == 1 else 2 for k in sites)
+                expand = sum(cost(body * k) for k in sites)
+                if expand <= keep:
+                    del rules[symbol]
+                    main[:] = inline(symbol, body, main)
+                    for other in rules:
+                        rules[other] = inline(symbol, body, rules[other])
+                    changed = True
+
     def _convert_to_ramps(self):
+        objects = []
         color_pre = None
         index = 0
         while index < len(self):
-            if isinstance(self[index], LightCommandRamp):
-                color_pre = self[index]._color()
-            elif isinstance(self[index], LightCommandColor):
+            o = self[index]
+            if isinstance(o, LightCommandRamp):
+                color_pre = o._color()
+            elif isinstance(o, LightCommandColor) and not isinstance(o, self.partial_colors):
                 if color_pre is not None:
-                    self[index] = LightCommandRamp(arguments=Arguments(list(self[index]._color().get_rgb()) + [0]), noop=self[index].noop)
-                color_pre = self[index]._color()
-            elif isinstance(self[index], LightCommandDelay):
-                delay_duration = self[index].get_duration()
-                if delay_duration > 0:
-                    if color_pre is not None:
-                        # delay followed by color
-                        if index + 1 < len(self) and isinstance(self[index + 1], LightCommandColor) and not isinstance(self[index + 1], LightCommandRamp):
-                            color = self[index + 1]._color()
-                            if delay_duration > 1:
-                                self[index] = LightCommandRamp(arguments=Arguments(list(color_pre.get_rgb()) + [delay_duration - 1]), noop=self[index].noop)
-                                index += 1
-                            else:
-                                self.pop(index)
-                            self[index] = LightCommandRamp(arguments=Arguments(list(color.get_rgb()) + [1]), noop=self[index].noop)
-                            color_pre = color
-                        else:
-                            self[index] = LightCommandRamp(arguments=Arguments(list(color_pre.get_rgb()) + [delay_duration]), noop=self[index].noop)
-                else:
-                    self.pop(index)
-                    index -= 1
+                    o = LightCommandRamp(arguments=Arguments(list(o._color().get_rgb()) + [0]), noop=o.noop, check=False)
+                color_pre = o._color()
+            elif isinstance(o, LightCommandDelay):
+                delay_duration = o.get_duration()
+                if delay_duration <= 0:
+                    index += 1
+                    continue
+                if color_pre is not None:
+                    # delay followed by color
+                    if index + 1 < len(self) and isinstance(self[index + 1], LightCommandColor) and not isinstance(self[index + 1], (LightCommandRamp,) + self.partial_colors):
+                        index += 1
+                        color = self[index]._color()
+                        if delay_duration > 1:
+                            objects.append(LightCommandRamp(arguments=Arguments(list(color_pre.get_rgb()) + [delay_duration - 1]), noop=o.noop, check=False))
+                        o = LightCommandRamp(arguments=Arguments(list(color.get_rgb()) + [1]), noop=self[index].noop, check=False)
+                        color_pre = color
+                    else:
+                        o = LightCommandRamp(arguments=Arguments(list(color_pre.get_rgb()) + [delay_duration]), noop=o.noop, check=False)
             else:
                 color_pre = None
+            objects.append(o)
             index += 1
+        self[:] = objects
 
     def _convert_from_ramps(self):
+        objects = []
         color_pre = None
-        index = 0
-        while index < len(self):
-            if isinstance(self[index], LightCommandRamp):
-                color = self[index]._color()
-                duration = self[index].get_duration()
+        for o in self:
+            if isinstance(o, LightCommandRamp):
+                color = o._color()
+                duration = o.get_duration()
                 if color_pre is not None and color == color_pre:
-                    self[index] = LightCommandDelay(arguments=Arguments([duration]), noop=self[index].noop)
+                    o = LightCommandDelay(arguments=Arguments([duration]), noop=o.noop, check=False)
                 elif duration == 0:
-                    self[index] = LightCommandColor(arguments=Arguments(list(color.get_rgb())), noop=self[index].noop)
+                    o = LightCommandColor(arguments=Arguments(list(color.get_rgb())), noop=o.noop, check=False)
                 elif duration == 1:
-                    self[index] = LightCommandDelay(arguments=Arguments([duration]))
-                    self.insert(index + 1, LightCommandColor(arguments=Arguments(list(color.get_rgb())), noop=self[index].noop))
-                    index += 1
+                    objects.append(LightCommandDelay(arguments=Arguments([duration]), check=False))
+                    o = LightCommandColor(arguments=Arguments(list(color.get_rgb())), check=False)
                 color_pre = color
-            elif isinstance(self[index], LightCommandColor):
-                color_pre = self[index]._color()
-            elif isinstance(self[index], LightCommandDelay):
-                pass
-            else:
+            elif isinstance(o, LightCommandColor):
+                color_pre = o._color()
+            elif not isinstance(o, LightCommandDelay):
                 color_pre = None
-            index += 1
+            objects.append(o)
+        self[:] = objects
 
         self._compress_adjacent_delays()
 
     def _compress_douglas_peucker(self, pos_first, pos_last, epsilon):
-        c_first = self[pos_first]._color()
-        c_last = self[pos_last]._color()
+        if epsilon < 0:
+            return 0
+
+        # keyframes: time and color reached with each command
+        objects = self[pos_first: pos_last + 1]
+        times = np.cumsum([0] + [o.get_duration() for o in objects[1:]])
+        colors = np.array([o._color().get_rgb() for o in objects], dtype=np.float64)
+        if not np.isfinite(colors).all():
+            error('ramp compression of colors without all components')
+
+        # segments between kept keyframes, replaced by a single ramp if within epsilon
+        merged = {}
+        kept = []
+        segments = [(0, len(objects) - 1)]
+        while segments:
+            first, last = segments.pop()
+            if last - first < 2:
+                if last > first:
+                    kept.append(last)
+                continue
+
+            duration = times[last] - times[first]
+            if duration > 0:
+                factor = (times[first + 1: last] - times[first]) / duration
+            else:
+                factor = np.zeros(last - first - 1)
+            interpolated = colors[first] * (1 - factor)[:, None] + colors[last] * factor[:, None]
+            diff = interpolated - colors[first + 1: last]
+            distances = np.sqrt(diff[:, 0] * diff[:, 0] + diff[:, 1] * diff[:, 1] + diff[:, 2] * diff[:, 2])
 
-        duration = sum(o.get_duration() for o in self[pos_first + 1: pos_last + 1])
-        time = 0
-        d_max = 0
-        pos_max = 0
-
-        if epsilon >= 0 and pos_last - pos_first >= 2:
-            for i in range(pos_first + 1, pos_last):
-                time += self[i].get_duration()
-                c_interpolated = (c_first * (1 - (time / duration)) + c_last * (time / duration))
-                c_diff = c_interpolated.distance(self[i]._color())
-                if c_diff > d_max:
-                    d_max = c_diff
-                    pos_max = i
+            # first keyframe with the largest distance rounded like Color.distance
+            d_raw = float(distances.max())
+            d_max = round(d_raw, 4)
 
             if d_max <= epsilon:
-                arguments = Arguments(self[pos_last].arguments._expand()[0: 3] + [duration])
-                for i in range(pos_first, pos_last):
-                    self.pop(pos_first + 1)
-                self.insert(pos_first + 1, LightCommandRamp(arguments=arguments, noop=" ; COMPRESSED (e_max={:.2f})".format(d_max)))
+                merged[last] = (int(duration), d_max)
+                kept.append(last)
+            else:
+                candidates = np.flatnonzero(distances >= d_raw - 0.0001)
+                pos_max = first + 1 + next((int(i) for i in candidates if round(float(distances[i]), 4) == d_max), int(distances.argmax()))
+                segments.append((first, pos_max))
+                segments.append((pos_max, last))
+
+        sequence = [objects[0]]
+        for last in sorted(kept):
+            if last in merged:
+                duration, d_max = merged[last]
+                arguments = Arguments(objects[last].arguments._expand()[0: 3] + [duration])
+                sequence.append(LightCommandRamp(arguments=arguments, noop=" ; COMPRESSED (e_max={:.2f})".format(d_max), check=False))
             else:
-                # start with last part as list indexes could otherwise be wrong
-                self._compress_douglas_peucker(pos_max, pos_last, epsilon)
-                self._compress_douglas_peucker(pos_first, pos_max, epsilon)
+                sequence.append(objects[last])
+        self[pos_first: pos_last + 1] = sequence
+        return max((d_max for _, d_max in merged.values()), default=0)
+
+    def _compress_ramp_fit(self, epsilon):
+        if epsilon < 0:
+            return 0
+
+        fitter = RampFitter(epsilon, noop=' ; COMPRESSED (e_max={:.2f})')
+        for o in self:
+            fitter.append(o._color().get_rgb(), o.get_duration(), o)
+        self[:] = fitter.finish()
+        return fitter.error
 
 
 class LightSequenceLoop(LightSequence):
@@ -804,16 +1568,93 @@ class LightSequenceLoop(LightSequence):
     def _count(self):
         return self.arguments[0]
 
-    def get_duration(self, root=None):
-        return super().get_duration(root) * self._count()
+    def _get_duration(self, root):
+        return super()._get_duration(root) * self._count()
+
+    # The exit color of an iteration only depends on the entry color and
+    # applying the body twice gives the same exit color as applying it once.
+    # So all iterations from the second one on are identical: at most two
+    # iterations get rendered, the last one is repeated for the rest.
 
     def _render_connected(self, color_pre, root=None):
         colors = []
-        for l in range(self._count()):
-            l_colors, color_pre = super()._render_connected(color_pre, root)
+        l_colors = []
+        count = self._count()
+        rendered = 0
+        while rendered < min(count, 2):
+            l_colors, color_post = super()._render_connected(color_pre, root)
             colors.extend(l_colors)
+            rendered += 1
+            if color_post == color_pre:
+                break
+            color_pre = color_post
+        colors.extend(l_colors * (count - rendered))
         return colors, color_pre
 
+    def _render_array(self, array, offset, color_pre, root=None):
+        count = self._count()
+        start = offset
+        rendered = 0
+        while rendered < min(count, 2):
+            start = offset
+            offset, color_post = super()._render_array(array, offset, color_pre, root)
+            rendered += 1
+            if color_post == color_pre:
+                break
+            color_pre = color_post
+        duration = offset - start
+        repeat = count - rendered
+        if repeat > 0 and duration > 0:
+            # broadcast the last iteration into a (repeat, duration, 3) view
+            array[offset: offset + repeat * duration].reshape(repeat, duration, 3)[:] = array[start: offset]
+            offset += repeat * duration
+        return offset, color_pre
+
+    def _render_segments(self, segments, start, color_pre, root=None):
+        count = self._count()
+        l_segments = SegmentList()
+        l_start = start
+        rendered = 0
+        while rendered < min(count, 2):
+            l_segments = SegmentList()
+            l_start = start
+            start, color_post = super()._render_segments(l_segments, start, color_pre, root)
+            segments.extend_shifted(l_segments, 0)
+            rendered += 1
+            if color_post == color_pre:
+                break
+            color_pre = color_post
+        duration = start - l_start
+        for l in range(count - rendered):
+            segments.extend_shifted(l_segments, (l + 1) * duration)
+        return start + (count - rendered) * duration, color_pre
+
+    def _render_range(self, array, offset, time_start, time_end, color_pre, root=None):
+        starts, changes = root.time_index.lookup(self)
+        duration = starts[-1]
+        if duration == 0:
+            return
+        # iterations after the first one all start with the same color
+        color_steady = changes[-1] | color_pre
+        l = time_start // duration
+        while l * duration < time_end:
+            l_start = max(time_start - l * duration, 0)
+            l_end = min(time_end - l * duration, duration)
+            l_offset = offset + l * duration + l_start - time_start
+            super()._render_range(array, l_offset, l_start, l_end, color_steady if l > 0 else color_pre, root)
+            l += 1
+            if l > 1 and l_start == 0 and l_end == duration:
+                # repeat the last full iteration for all following full ones
+                repeat = time_end // duration - l
+                if repeat > 0:
+                    array[l_offset + duration: l_offset + (repeat + 1) * duration].reshape(repeat, duration, 3)[:] = array[l_offset: l_offset + duration]
+                    l += repeat
+
+    def _color_change(self, root):
+        if self._count() == 0:
+            return Color.intern(None, None, None)
+        return super()._color_change(root)
+
     def _calculate_factors(self, number, max_number):
         m = max_number
         while m > 2:
@@ -827,17 +1668,16 @@ class LightSequenceLoop(LightSequence):
     def _loop_unfold(self):
         factor_1, factor_2, rest = self._calculate_factors(number=self._count(), max_number=self.max_count)
         noop = f'; LOOP UNFOLD: {factor_1} * {factor_2} + {rest} = {self._count()}' + (self.noop or '')
-        commands = LightSequenceLoop(objects=[LightSequenceLoop(objects=self, arguments=Arguments([factor_2]))], arguments=Arguments([factor_1]), noop=noop)._resolve_unsupported()
+        commands = LightSequenceLoop(objects=[LightSequenceLoop(objects=self, arguments=Arguments([factor_2]), check=False)], arguments=Arguments([factor_1]), noop=noop, check=False)._resolve_unsupported()
         if rest > 0:
-            commands.append(LightSequenceLoop(objects=self, arguments=Arguments([rest])))
+            commands.append(LightSequenceLoop(objects=self, arguments=Arguments([rest]), check=False))
         return commands
 
-    def _resolve_unsupported(self):
-        self.resolve_unsupported()
+    def _resolved(self):
         if self._count() == 0:
-            return [LightCommandNoop(noop=self.noop)]
+            return [LightCommandNoop(noop=self.noop, check=False)]
         elif self._count() == 1:
-            return [LightCommandNoop(noop=self.noop)] + self
+            return [LightCommandNoop(noop=self.noop, check=False)] + self
         elif self._count() > self.max_count:
             return self._loop_unfold()
         else:
@@ -911,6 +1751,23 @@ class LightSequenceFile(LightSequence):
         LightSequenceMain,
         LightSequenceDefsub
     )
+    _subs = None
+    transient = ('_duration_cache', '_subs', 'sub_cache', 'time_index', 'sub_durations', 'sub_color_changes', 'sub_durations_revision')
+
+    def __init__(self, arguments=[], objects=[], noop=None, check=True):
+        super().__init__(arguments=arguments, objects=objects, noop=noop, check=check)
+        self._init_caches()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_caches()
+
+    def _init_caches(self):
+        self.sub_cache = RenderCache()
+        self.time_index = TimeIndex(self)
+        self.sub_durations = {}
+        self.sub_color_changes = {}
+        self.sub_durations_revision = revision
 
     def get_main(self):
         for object in self:
@@ -918,33 +1775,175 @@ class LightSequenceFile(LightSequence):
                 return object
         error(f'main sequence not found')
 
+    def _modified(self):
+        super()._modified()
+        self._subs = None
+
+    def append(self, item, check=True):
+        subs = self._subs
+        super().append(item, check)
+        if subs is not None:
+            self._index_subs(subs, [item])
+            self._subs = subs
+
+    def extend(self, items, check=True):
+        subs = self._subs
+        super().extend(items, check)
+        if subs is not None:
+            self._index_subs(subs, items)
+            self._subs = subs
+
+    def _index_subs(self, subs, items):
+        # the first definition of a name wins
+        for item in items:
+            if isinstance(item, LightSequenceDefsub):
+                subs.setdefault(item.get_name(), item)
+
+    def _get_subs(self):
+        if self._subs is None:
+            self._subs = {}
+            self._index_subs(self._subs, self)
+        return self._subs
+
     def get_sub(self, name):
-        for object in self:
-            if isinstance(object, LightSequenceDefsub) and object.get_name() == name:
-                return object
-        error(f'sub not found {name}')
+        sub = self._get_subs().get(name)
+        if sub is None or sub.get_name() != name:
+            # a defsub might have been renamed in place
+            self._subs = None
+            sub = self._get_subs().get(name)
+            if sub is None:
+                error(f'sub not found {name}')
+        return sub
+
+    def check_subs(self):
+        for o in self.walk():
+            if isinstance(o, LightCommandSub) and o.arguments[0] not in self._get_subs():
+                error(f'sub \'{o.arguments[0]}\' is called but not defined')
+
+    def add_namespace(self, namespace):
+        super().add_namespace(namespace)
+        self._subs = None
+
+    def _structure(self, objects, classes, ids):
+        # comments do not matter, calls are identified by the structure of the called sub
+        key = []
+        for o in objects:
+            if isinstance(o, LightCommandNoop):
+                continue
+            if isinstance(o, LightCommandSub):
+                key.append((LightCommandSub, self._sub_class(o.arguments[0], classes, ids)))
+            elif isinstance(o, LightSequence):
+                key.append((type(o), o.arguments, self._structure(o, classes, ids)))
+            else:
+                key.append((type(o), o.arguments))
+        return tuple(key)
+
+    def _sub_class(self, name, classes, ids):
+        # numbers of structurally identical subs are equal, also across files sharing classes
+        if name not in ids:
+            # recursive and undefined subs only equal themselves
+            ids[name] = name
+            sub = self._get_subs().get(name)
+            if sub is not None:
+                ids[name] = classes.setdefault(self._structure(sub, classes, ids), len(classes))
+        return ids[name]
+
+    def deduplicate_subs(self, classes):
+        ids = {}
+        names = {}
+        removed = []
+        for o in self:
+            if isinstance(o, LightSequenceDefsub) and self._get_subs().get(o.get_name()) is o:
+                c = self._sub_class(o.get_name(), classes, ids)
+                if c in names:
+                    removed.append(o)
+                else:
+                    names[c] = o.get_name()
+
+        if removed:
+            removed_ids = set(map(id, removed))
+            self[:] = [o for o in self if id(o) not in removed_ids]
+            renamed = {ds.get_name(): names[ids[ds.get_name()]] for ds in removed}
+            # defsubs and calls may share their arguments
+            for o in self.walk():
+                if isinstance(o, LightCommandSub) and o.arguments[0] in renamed:
+                    o.arguments = Arguments([renamed[o.arguments[0]]])
+            modified()
+
+        return removed, set(names)
+
+    def _validate_sub_caches(self):
+        # any change of the tree invalidates durations and color changes of all subs
+        if self.sub_durations_revision != revision:
+            self.sub_durations.clear()
+            self.sub_color_changes.clear()
+            self.sub_durations_revision = revision
+
+    def get_sub_duration(self, name):
+        self._validate_sub_caches()
+        if name in self.sub_durations:
+            if debug_cache:
+                self._check_cache(f'duration of sub \'{name}\'', self.sub_durations[name], self.get_sub(name).get_duration(self))
+            return self.sub_durations[name]
+        duration = self.get_sub(name).get_duration(self)
+        self.sub_durations[name] = duration
+        return duration
+
+    def get_sub_color_change(self, name):
+        self._validate_sub_caches()
+        if name in self.sub_color_changes:
+            if debug_cache:
+                self._check_cache(f'color change of sub \'{name}\'', self.sub_color_changes[name], self.get_sub(name)._color_change(self))
+            return self.sub_color_changes[name]
+        change = self.get_sub(name)._color_change(self)
+        self.sub_color_changes[name] = change
+        return change
 
     def get_duration(self, root=None):
         return self.get_main().get_duration(root=self)
 
     def render(self):
-        return self.get_main().render(root=self)
+        return ColorList(Color(*rgb) for rgb in self.render_array().tolist())
+
+    def render_array(self, amplify=False):
+        # the sub cache only lives for one render and only keeps subs called more than once
+        calls = collections.Counter(o.arguments[0] for o in self.walk() if isinstance(o, LightCommandSub))
+        self.sub_cache.names = {name for name, count in calls.items() if count > 1}
+        try:
+            array = self.get_main().render_array(root=self, amplify=amplify)
+            if debug:
+                print(f'sub render cache: {len(self.sub_cache)} entries, {self.sub_cache.hits} hits, {self.sub_cache.misses} misses')
+        finally:
+            self.sub_cache.release()
+        return array
+
+    def render_segments(self):
+        return self.get_main().render_segments(root=self)
+
+    def render_range(self, time_start, time_end, amplify=False):
+        time_start = max(time_start, 0)
+        time_end = min(time_end, self.get_duration())
+        array = np.zeros((max(time_end - time_start, 0), 3), dtype=np.uint8)
+        if time_end > time_start:
+            self.get_main()._render_range(array, 0, time_start, time_end, Color(), self)
+        if amplify:
+            return Color.amplify_array[array]
+        return array
 
     def shift_labels(self, labels):
         main = self.get_main()
-        index = 0
+        objects = []
         time = 0
         time_ref = 0
-        while index < len(main):
-            object = main[index]
+        for object in main:
             if isinstance(object, LightCommandTime):
-                objects, time_ref = main[index].resolve(labels, time, time_ref)
-                main.pop(index)
-                for o in range(len(objects)):
-                    main.insert(index + o, objects[o])
-                index -= 1
-            index += 1
-            time += object.get_duration(root=self)
+                resolved, time_ref = object.resolve(labels, time, time_ref)
+            else:
+                resolved = [object]
+            for o in resolved:
+                objects.append(o)
+                time += o.get_duration(root=self)
+        main[:] = objects
 
     def compress(self, options):
         options['root'] = self
@@ -955,82 +1954,429 @@ class LightSequenceFile(LightSequence):
         self.extend(list(filter(lambda o: not isinstance(o, LightSequenceMain), list(other))))
 
 
+class RampFitter():
+    # greedy online fitting of ramps to a stream of keyframes
+    # a ramp of d ticks from color a to keyframe p[d] shows a + (p[d] - a) * n / d at tick n,
+    # every keyframe p[n] in between restricts the velocity v = (p[d] - a) / d to a ball
+    # with center (p[n] - a) / n and radius epsilon / n, a keyframe can end the ramp if its
+    # velocity lies within all balls of the keyframes before
+    # at most max_balls balls are kept, the widest ones are merged into a single inner ball
+    # that lies within all of them, so every keyframe costs constant time
+    max_balls = 32
+
+    def __init__(self, epsilon, max_duration=LightCommandRamp.max_duration, noop=None):
+        # Color.distance rounds to 4 decimals
+        self.epsilon = epsilon + 0.00005
+        self.max_duration = max_duration
+        self.noop = noop
+        self.commands = []
+        self.queue = collections.deque()
+        self.anchor = None
+        self.error = 0
+        self._reset()
+
+    def _reset(self):
+        self.duration = 0
+        self.balls = []
+        self.points = []
+        self.end = -1
+        self.inner = None
+        self.empty = False
+        # bounding box of the intersection of all balls
+        self.low = [-math.inf] * 3
+        self.high = [math.inf] * 3
+
+    def _merge(self, ball):
+        # largest ball within the inner ball and ball, empty if they do not overlap
+        if self.inner is None:
+            self.inner = ball
+            return
+        c, r = self.inner[:3], self.inner[3]
+        d = math.sqrt((ball[0] - c[0]) ** 2 + (ball[1] - c[1]) ** 2 + (ball[2] - c[2]) ** 2)
+        if d + r <= ball[3]:
+            return
+        if d + ball[3] <= r:
+            self.inner = ball
+        elif d >= r + ball[3]:
+            self.empty = True
+        else:
+            # centered between the far ends of the lens both balls form
+            f = (d - ball[3] + r) / 2 / d
+            self.inner = tuple(a + (b - a) * f for a, b in zip(c, ball[:3])) + ((r + ball[3] - d) / 2,)
+
+    def append(self, color, duration=1, command=None):
+        # command reproduces a keyframe that does not get merged
+        if self.anchor is None:
+            self.commands.append(command if command is not None else LightCommandColor(arguments=Arguments(color), check=False))
+            self.anchor = color
+            return
+        self.queue.append((color, duration, command))
+        self._process()
+
+    def _process(self):
+        while self.queue:
+            color, duration, command = self.queue.popleft()
+            d = self.duration + duration
+            if d == 0:
+                # no ramp reaches a color in no time, jumps are kept
+                self.points.append((0, color, command, 0))
+                self.end = 0
+                self._emit()
+                continue
+
+            v = tuple((c - a) / d for c, a in zip(color, self.anchor))
+            if d <= self.max_duration and all(
+                (v[0] - b[0]) ** 2 + (v[1] - b[1]) ** 2 + (v[2] - b[2]) ** 2 <= b[3] ** 2 for b in self.balls
+            ) and (self.inner is None or (v[0] - self.inner[0]) ** 2 + (v[1] - self.inner[1]) ** 2 + (v[2] - self.inner[2]) ** 2 <= self.inner[3] ** 2):
+                self.end = len(self.points)
+
+            # balls containing the new one do not restrict any further
+            r = self.epsilon / d
+            self.balls = [
+                b for b in self.balls
+                if math.sqrt((v[0] - b[0]) ** 2 + (v[1] - b[1]) ** 2 + (v[2] - b[2]) ** 2) + r > b[3]
+            ]
+            self.balls.append(v + (r,))
+            if len(self.balls) > self.max_balls:
+                widest = max(range(len(self.balls)), key=lambda i: self.balls[i][3])
+                self._merge(self.balls.pop(widest))
+            self.low = [max(l, c - r) for l, c in zip(self.low, v)]
+            self.high = [min(h, c + r) for h, c in zip(self.high, v)]
+            self.points.append((d, color, command, duration))
+            self.duration = d
+
+            # keyframes after the last possible end of the ramp start the next one,
+            # looking ahead at most as far as the ramp reaches keeps the fitting linear
+            if d >= self.max_duration or len(self.points) > 2 * (self.end + 1) or self.empty or any(l > h for l, h in zip(self.low, self.high)):
+                self._emit()
+
+    def _emit(self):
+        if self.end < 0:
+            # a keyframe too long for any ramp is kept as it is
+            self.end = 0
+        points = self.points[: self.end + 1]
+        d, target, command, _ = points[-1]
+        if len(points) == 1 and command is not None:
+            self.commands.append(command)
+        else:
+            e_max = 0
+            for n, color, _, _ in points[: -1]:
+                f = n / d
+                e_max = max(e_max, round(math.sqrt(sum((a * (1 - f) + t * f - c) ** 2 for a, t, c in zip(self.anchor, target, color))), 4))
+            self.error = max(self.error, e_max)
+            noop = self.noop.format(e_max) if self.noop is not None else None
+            self.commands.append(LightCommandRamp(arguments=Arguments(target + (d,)), noop=noop, check=False))
+        self.queue.extendleft((color, duration, command) for _, color, command, duration in reversed(self.points[self.end + 1:]))
+        self.anchor = target
+        self._reset()
+
+    def finish(self):
+        while self.points:
+            self._emit()
+            self._process()
+        return self.commands
+
+
+# per prop work in worker processes, the trees are pickled to the workers and back
+
+def _init_worker(debug_enabled, debug_cache_enabled):
+    global debug, debug_cache
+    debug = debug_enabled
+    debug_cache = debug_cache_enabled
+
+
+def _run_captured(function, args):
+    # the console output is printed by the main process in the order of the props
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        try:
+            return function(*args), output.getvalue(), None
+        except Exception as e:
+            return None, output.getvalue(), e
+
+
+def _compress_glo(glo, options):
+    glo.compress(options)
+    return glo
+
+
+def _visit_glo(glo, group):
+    # the counters of the copies only count the work of this worker
+    for p in group:
+        p.time, p.visited, p.changed = 0, 0, 0
+    PassManager()._visit(glo, group)
+    return glo, [(p.time, p.visited, p.changed) for p in group]
+
+
+def _export_glo(glo, filename, syntax, indent):
+    print(f'writing {filename}: {glo.get_duration()/resolution:.2f} seconds')
+    with open(filename, 'w') as f:
+        f.write(glo.export(syntax=syntax, indent=indent))
+
+
+def _render_glo(glo, amplify):
+    return glo.render_array(amplify)
+
+
+def _render_glo_range(glo, time_start, time_end, amplify):
+    return glo.render_range(time_start, time_end, amplify)
+
+
+class Pass():
+    # transformation of all sequences of a GloList, nodes changed are nodes replaced, removed or added
+    # compared by their values, the trees might come back from worker processes as copies,
+    # they are only counted with statistics as this walks all trees twice
+    name = None
+
+    def __init__(self):
+        self.time = 0
+        self.visited = 0
+        self.changed = 0
+
+    def _nodes(self, glo_list):
+        return collections.Counter((type(o), tuple(o.arguments), o.noop) for glo in glo_list for o in glo.walk())
+
+    def run(self, glo_list, jobs=None, statistics=False):
+        before = self._nodes(glo_list) if statistics else None
+        start = perf_counter()
+        self.apply(glo_list, jobs)
+        self.time += perf_counter() - start
+        if not statistics:
+            return
+        after = self._nodes(glo_list)
+        self.visited += sum(before.values())
+        self.changed += sum(((before - after) + (after - before)).values())
+
+    def apply(self, glo_list, jobs):
+        pass
+
+
+class VisitorPass(Pass):
+    # applied to every sequence after its children, returns the number of changed children
+    # adjacent fusable passes, which only change the children of the visited sequence,
+    # share a single traversal
+    fusable = False
+    message = None
+
+    def visit(self, sequence):
+        return 0
+
+
+class LabelsPass(Pass):
+    name = 'labels'
+
+    def __init__(self, labels):
+        super().__init__()
+        self.labels = labels
+
+    def apply(self, glo_list, jobs):
+        glo_list.apply_labels(self.labels)
+
+
+class CompressPass(Pass):
+    name = 'compress'
+
+    def __init__(self, options):
+        super().__init__()
+        self.options = options
+
+    def apply(self, glo_list, jobs):
+        glo_list.compress(self.options, jobs)
+
+
+class DeduplicatePass(Pass):
+    name = 'deduplicate'
+
+    def apply(self, glo_list, jobs):
+        glo_list.deduplicate()
+
+
+class ResolveConstantsPass(VisitorPass):
+    name = 'resolve constants'
+    message = 'resolving constants'
+    fusable = True
+
+    def visit(self, sequence):
+        return sequence._resolve_constants_children()
+
+
+class ResolveUnsupportedPass(VisitorPass):
+    # creates loops the other passes would not visit
+    name = 'resolve unsupported'
+    message = 'resolving unsupported commands'
+
+    def visit(self, sequence):
+        return sequence._resolve_unsupported_children()
+
+
+class StripPass(VisitorPass):
+    name = 'strip'
+    message = 'stripping comments'
+    fusable = True
+
+    def visit(self, sequence):
+        return sequence._strip_children()
+
+
+class PassManager():
+    def __init__(self, passes=[], jobs=None, statistics=False):
+        self.passes = list(passes)
+        self.jobs = jobs
+        self.statistics = statistics
+
+    def add(self, p):
+        self.passes.append(p)
+
+    def _groups(self):
+        groups = []
+        for p in self.passes:
+            if isinstance(p, VisitorPass) and p.fusable and groups and isinstance(groups[-1][-1], VisitorPass) and groups[-1][-1].fusable:
+                groups[-1].append(p)
+            else:
+                groups.append([p])
+        return groups
+
+    def run(self, glo_list):
+        for group in self._groups():
+            if isinstance(group[0], VisitorPass):
+                for p in group:
+                    print(p.message)
+                if self.jobs is not None and self.jobs > 1:
+                    results = glo_list._map(_visit_glo, [(glo, group) for glo in glo_list], self.jobs)
+                    for n, (glo, counters) in enumerate(results):
+                        glo_list[n] = glo
+                        for p, (t, visited, changed) in zip(group, counters):
+                            p.time += t
+                            p.visited += visited
+                            p.changed += changed
+                else:
+                    for glo in glo_list:
+                        self._visit(glo, group)
+            else:
+                group[0].run(glo_list, self.jobs, self.statistics)
+
+    def _visit(self, sequence, group):
+        for o in sequence:
+            if isinstance(o, LightSequence):
+                self._visit(o, group)
+        for p in group:
+            start = perf_counter()
+            p.visited += len(sequence)
+            p.changed += p.visit(sequence)
+            p.time += perf_counter() - start
+
+    def print_timing(self):
+        print('pass timing:')
+        for group in self._groups():
+            for p in group:
+                fused = ' (fused)' if len(group) > 1 else ''
+                print(f'{p.name}{fused}: {p.time * 1000:.1f} ms, {p.visited} nodes visited, {p.changed} nodes changed')
+
+
 class GloList(list):
-    def import_files(self, files, split_number=None):
+    # one alternative per kind of line, the first one matching the whole line wins
+    line_pattern = re.compile(
+        # label: ";LABEL name +10" / ";L-name"
+        r';(?:L-|LABEL )([-\w]*)(?: ([+-]?[0-9]+))?|'
+        # old syntax: "CMD, 1, 2, 3" / "command, 1, 2, 3"
+        r'\s*([A-Z]+|[a-z][A-Za-z\.]*)(?:\s*,\s*([^;]*[^;\s]+))?(?:\s*|(\s*;.*))?|'
+        # new syntax: "command (1, 2, 3)" / command (CONSTANT)"
+        r'\s*([a-z][A-Za-z\.]*)(?:\s*\(([^.:#;]*[^.:#;\s]+)\s*\))?(?:\s*|(\s*;.*))?|'
+        # define
+        r'\s*(#define)\s+([^ ]*)\s+([^;]*[^;\s]+)(?:\s*|(\s*;.*))?|'
+        # comment
+        r'(\s*(?:;.*)?)'
+    )
+
+    def import_files(self, files, split_number=None, cache=None):
         # any number of files without splitting
         if split_number is None:
             for f in files:
                 print(f'importing \'{f}\'')
-                with open(f) as file_object:
-                    self.append(self._import_glo(file_object))
+                self.extend(self._import_file(f, split_number, cache))
         # single file with split
         elif len(files) == 1:
             print(f'importing \'{files[0]}\' ({split_number})')
-            for file_object in self._split_file(files[0], split_number):
-                self.append(self._import_glo(file_object))
+            self.extend(self._import_file(files[0], split_number, cache))
         # multiple files with split
         else:
             # merge multiple files
             for f in range(len(files)):
                 print(f'importing/merging \'{files[f]}\' ({split_number})')
-                file_objects = self._split_file(files[f], split_number)
+                glos = self._import_file(files[f], split_number, cache)
                 for n in range(split_number):
-                    glo = self._import_glo(file_objects[n])
+                    glo = glos[n]
                     glo.add_namespace("G{:02}_".format(f + 1))
                     if f == 0:
                         self.append(glo)
                     else:
                         self[n].merge(glo)
 
-    def _color_row_to_colors(self, row):
-        o = []
+    def _import_file(self, filename, split_number, cache):
+        # stdin can not be hashed without reading it completely
+        key = None
+        if cache is not None and filename != '-':
+            key = cache.key(filename, split_number)
+            glos = cache.get(key)
+            if glos is not None:
+                return glos
 
-        color_pre = None
-        delay_repeat = 0
+        if split_number is None:
+            with self._open(filename) as file_object:
+                glos = [self._import_glo(file_object)]
+        else:
+            glos = [self._import_tokens(tokens) for tokens in self._split_file(filename, split_number)]
 
-        for i in range(0, len(row), 3):
-            color = tuple(row[i: i + 3])
+        if key is not None:
+            cache.put(key, glos)
+        return glos
 
-            if color == color_pre:
-                o.pop()
-                delay_repeat += 1
-            else:
-                o.append(LightCommandColor(arguments=Arguments(color)))
-                delay_repeat = 1
-            o.append(LightCommandDelay(arguments=Arguments([delay_repeat])))
+    def _color_runs(self, row):
+        # colors and lengths of runs of equal pixels
+        pixels = np.asarray(row, dtype=np.uint8).reshape(-1, 3)
+        starts = np.flatnonzero(np.any(pixels[1:] != pixels[:-1], axis=1)) + 1
+        starts = np.concatenate(([0], starts))
+        lengths = np.diff(np.append(starts, len(pixels)))
+        return list(map(tuple, pixels[starts].tolist())), lengths.tolist()
+
+    def _color_row_to_colors(self, row):
+        o = []
 
-            color_pre = color
+        for color, length in zip(*self._color_runs(row)):
+            o.append(LightCommandColor(arguments=Arguments(color), check=False))
+            o.append(LightCommandDelay(arguments=Arguments([length]), check=False))
 
         return o
 
     def _color_row_to_ramps(self, row):
-        o = []
+        # the first pixel only sets the color, all others ramp
+        color = tuple(row[0: 3])
+        o = [LightCommandColor(arguments=Arguments(color), check=False)]
+
+        if len(row) == 3:
+            o.append(LightCommandRamp(arguments=Arguments(color + (1,)), check=False))
+            return o
+
+        # each run ramps to its color in one tick and holds it for the remaining ticks,
+        # the last run holds its color for one more tick
+        colors, lengths = self._color_runs(row[3:])
+        lengths[-1] += 1
+        for color, length in zip(colors, lengths):
+            o.append(LightCommandRamp(arguments=Arguments(color + (1,)), check=False))
+            if length > 1:
+                o.append(LightCommandRamp(arguments=Arguments(color + (length - 1,)), check=False))
 
-        color_pre = None
-        delay_repeat = 1
+        return o
 
+    def _color_row_to_fitted_ramps(self, row, epsilon):
+        fitter = RampFitter(epsilon)
         for i in range(0, len(row), 3):
-            color = tuple(row[i: i + 3])
-
-            if i == 0:
-                o.append(LightCommandColor(arguments=Arguments(color)))
-            elif color == color_pre:
-                if delay_repeat > 1:
-                    o.pop()
-                o.append(LightCommandRamp(arguments=Arguments(color + (delay_repeat,))))
-                delay_repeat += 1
-            else:
-                delay_repeat = 1
-                o.append(LightCommandRamp(arguments=Arguments(color + (1,))))
-                color_pre = color
-
-        if delay_repeat > 1:
-            o.pop()
-        o.append(LightCommandRamp(arguments=Arguments(color + (delay_repeat,))))
-
+            fitter.append(tuple(row[i: i + 3]))
+        o = fitter.finish()
+        # the last color is shown for one tick like all other pixels
+        o.append(LightCommandRamp(arguments=Arguments(fitter.anchor + (1,)), check=False))
         return o
 
-    def import_png(self, filename, ramps):
+    def import_png(self, filename, ramps, epsilon=None):
         print(f'importing png: {filename}')
 
         r = png.Reader(filename=filename)
@@ -1045,83 +2391,81 @@ class GloList(list):
             sub_name = "image_{}_{:02}".format(filename.replace('.', '_'), i)
             i += 1
 
-            if ramps:
+            if epsilon is not None:
+                o = self._color_row_to_fitted_ramps(row, epsilon)
+            elif ramps:
                 o = self._color_row_to_ramps(row)
             else:
                 o = self._color_row_to_colors(row)
 
-            objects = [LightSequenceMain(objects=[LightCommandSub(arguments=Arguments([sub_name]))])]
-            objects.append(LightSequenceDefsub(arguments=Arguments([sub_name]), objects=o))
-            self.append(LightSequenceFile(objects=objects))
+            objects = [LightSequenceMain(objects=[LightCommandSub(arguments=Arguments([sub_name]), check=False)], check=False)]
+            objects.append(LightSequenceDefsub(arguments=Arguments([sub_name]), objects=o, check=False))
+            self.append(LightSequenceFile(objects=objects, check=False))
 
     def _split_file(self, file_object, number):
+        # every line is tokenized once, then handed to all props it is active for
         active = set(range(number))
         handled = set()
 
-        iofiles = []
-        for count in range(number):
-            iofiles.append(io.StringIO())
-
-        f = open(file_object)
-
-        for line in f:
-            m = re.search('^<(.*)>$', line)
-            if m:
-                split_command = m.group(1)
-                n = re.search('^[0-9]*(,[0-9]*)*$', split_command)
-                if n:
-                    active = set()
-                    for a in (map(int, split_command.split(","))):
-                        active.add(a - 1)
-                    handled.update(active)
-                elif split_command == "default":
-                    active = set()
-                    for count in range(number):
-                        if count not in handled:
-                            active.add(count)
-                elif split_command == "end":
-                    active = set(range(number))
-                    handled = set()
-            else:
-                for count in range(number):
-                    if count in active:
-                        iofiles[count].write(line)
-
-        f.close()
-
-        for count in range(number):
-            iofiles[count].seek(0)
-
-        return iofiles
-
-    def _import_glo(self, glo_file):
+        tokens = []
+
+        with self._open(file_object) as f:
+            for line in f:
+                m = re.search('^<(.*)>$', line)
+                if m:
+                    split_command = m.group(1)
+                    n = re.search('^[0-9]*(,[0-9]*)*$', split_command)
+                    if n:
+                        # blocks for props beyond number are skipped without parsing
+                        active = set()
+                        for a in (map(int, split_command.split(","))):
+                            if 0 < a <= number:
+                                active.add(a - 1)
+                        handled.update(active)
+                    elif split_command == "default":
+                        active = set()
+                        for count in range(number):
+                            if count not in handled:
+                                active.add(count)
+                    elif split_command == "end":
+                        active = set(range(number))
+                        handled = set()
+                elif active:
+                    tokens.append((self._tokenize(line), active))
+
+        return [[t for t, a in tokens if count in a] for count in range(number)]
+
+    def _open(self, filename):
+        # '-' reads from stdin
+        if filename == '-':
+            return contextlib.nullcontext(sys.stdin)
+        return open(filename)
+
+    def _import_glo(self, glo_lines):
+        return self._import_tokens(map(self._tokenize, glo_lines))
+
+    def _import_tokens(self, tokens):
         constants = {}
+        command_dicts = {}
 
         sequence_main = LightSequenceMain()
-        self._scan_glo(glo_file, sequence_main, constants=constants)
-
         sequence_file = LightSequenceFile(objects=[sequence_main])
-        self._scan_glo(glo_file, sequence_file, constants=constants)
 
-        return sequence_file
+        # open sequences, the innermost last; the file itself is never closed
+        stack = [sequence_file, sequence_main]
 
-    def _scan_glo(self, glo_file, light_sequence, constants={}):
-        command_dict = light_sequence.valid_objects_dict()
-        exit_commands = light_sequence.exit_commands()
+        for command, name, values, noop in tokens:
+            light_sequence = stack[-1]
 
-        for line in glo_file:
-            m = re.search('^;(?:L-|LABEL )([-\w]*)(?: ([+-]?[0-9]+))?$', line)
-            if m:
-                if m.group(2) is not None:
-                    line = "time ({}, {}, {}, {})".format('set', 'label', m.group(1), m.group(2))
-                else:
-                    line = "time ({}, {}, {})".format('set', 'label', m.group(1))
+            arguments = self._resolve_arguments(values, constants, name)
 
-            command, name, arguments, noop = self._split_line(line.rstrip())
-            arguments = self._split_arguments(arguments, constants, name)
+            if command in light_sequence.exit_commands():
+                stack.pop()
+                continue
 
-            if command in exit_commands:
-                return
+            if type(light_sequence) not in command_dicts:
+                command_dicts[type(light_sequence)] = light_sequence.valid_objects_dict()
+            command_dict = command_dicts[type(light_sequence)]
 
             if command not in command_dict:
                 error(f'command "{command}" not allowed in \'{light_sequence.name}\'')
@@ -1133,50 +2477,57 @@ class GloList(list):
                 constants[name] = arguments
 
             if isinstance(light_object, LightSequence):
-                self._scan_glo(glo_file, light_object, constants=constants)
-
-        if len(exit_commands) == 0:
-            return
-        else:
-            error(f'end of file reached in \'{light_sequence.name}\'')
-
-    def _split_line(self, line):
-        # old syntax: "CMD, 1, 2, 3" / "command, 1, 2, 3"
-        m = re.search('^\s*([A-Z]+|[a-z][A-Za-z\.]*)(?:\s*,\s*([^;]*[^;\s]+))?(?:\s*|(\s*;.*))?$', line)
-        if m:
-            return m.group(1), None, m.group(2), m.group(3)
-
-        # new syntax: "command (1, 2, 3)" / command (CONSTANT)"
-        m = re.search('^\s*([a-z][A-Za-z\.]*)(?:\s*\(([^.:#;]*[^.:#;\s]+)\s*\))?(?:\s*|(\s*;.*))?$', line)
-        if m:
-            return m.group(1), None, m.group(2), m.group(3)
+                stack.append(light_object)
 
-        # define
-        m = re.search('^\s*(#define)\s+([^ ]*)\s+([^;]*[^;\s]+)(?:\s*|(\s*;.*))?$', line)
-        if m:
-            return m.group(1), m.group(2), m.group(3), m.group(4)
+        if len(stack) > 1:
+            error(f'end of file reached in \'{stack[-1].name}\'')
 
-        # comment
-        m = re.search('^(\s*(?:;.*)?)$', line)
-        if m:
-            return 'noop', None, None, m.group(1)
+        sequence_file.check_subs()
 
-        error(f'could not parse line: "{line}"')
+        return sequence_file
 
-    def _split_arguments(self, arguments_str, constants, name):
-        arguments = []
+    def _split_line(self, line):
+        m = GloList.line_pattern.fullmatch(line)
+        if m is None:
+            error(f'could not parse line: "{line}"')
+
+        g = m.groups()
+        if g[2] is not None:
+            return g[2], None, g[3], g[4]
+        if g[5] is not None:
+            return g[5], None, g[6], g[7]
+        if g[8] is not None:
+            return g[8], g[9], g[10], g[11]
+        if g[0] is not None:
+            return 'time', None, ', '.join(['set', 'label'] + [a for a in g[0:2] if a is not None]), None
+        return 'noop', None, None, g[12]
+
+    def _tokenize(self, line):
+        command, name, arguments, noop = self._split_line(line.rstrip())
+        return command, name, self._split_values(arguments), noop
+
+    def _split_values(self, arguments_str):
+        values = []
 
         if arguments_str is not None:
-            for arg in (a.strip() for a in arguments_str.split(',')):
+            for arg in map(str.strip, arguments_str.split(',')):
                 try:
                     arg = int(arg)
                 except ValueError:
                     pass
 
-                if isinstance(arg, str) and re.match('[A-Z]', arg) and arg in constants.keys():
-                    arg = constants[arg]
+                values.append(arg)
+
+        return values
+
+    def _resolve_arguments(self, values, constants, name):
+        arguments = []
 
-                arguments.append(arg)
+        for arg in values:
+            if isinstance(arg, str) and arg in constants and 'A' <= arg[:1] <= 'Z':
+                arg = constants[arg]
+
+            arguments.append(arg)
 
         return Arguments(name=name, objects=arguments)
 
@@ -1186,24 +2537,50 @@ class GloList(list):
             glo.shift_labels(labels)
 
     def resolve_constants(self):
-        print("resolving constants")
-        for glo in self:
-            glo.resolve_constants()
+        PassManager([ResolveConstantsPass()]).run(self)
 
-    def compress(self, options):
+    def _imap(self, function, items, jobs=None):
+        # calls function for each tuple of arguments, in up to jobs worker processes, yields the results in order
+        if jobs is None or jobs < 2 or len(items) < 2:
+            for args in items:
+                yield function(*args)
+            return
+
+        # at most jobs items are in flight, the next one is submitted when a result is taken
+        items = iter(items)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(debug, debug_cache)) as executor:
+            futures = collections.deque(executor.submit(_run_captured, function, args) for args in itertools.islice(items, jobs))
+            while futures:
+                result, output, exception = futures.popleft().result()
+                print(output, end='')
+                if exception is not None:
+                    executor.shutdown(cancel_futures=True)
+                    raise exception
+                futures.extend(executor.submit(_run_captured, function, args) for args in itertools.islice(items, 1))
+                yield result
+
+    def _map(self, function, items, jobs=None):
+        return list(self._imap(function, items, jobs))
+
+    def compress(self, options, jobs=None):
         print("compressing sequences")
-        for glo in self:
-            glo.compress(options)
+        self[:] = self._map(_compress_glo, [(glo, options) for glo in self], jobs)
 
-    def resolve_unsupported(self):
-        print("resolving unsupported commands")
-        for glo in self:
-            glo.resolve_unsupported()
+    def deduplicate(self):
+        print("deduplicating subs")
+        classes = {}
+        results = [glo.deduplicate_subs(classes) for glo in self]
+        counts = collections.Counter(c for _, subs in results for c in subs)
+        for n, (removed, subs) in enumerate(results):
+            commands = sum(len(list(ds.walk())) for ds in removed)
+            shared = sum(1 for c in subs if counts[c] > 1)
+            print(f'#{n + 1:02} - removed {len(removed)} subs ({commands} commands), {shared} of {len(subs)} subs shared with other sequences')
+
+    def resolve_unsupported(self, jobs=None):
+        PassManager([ResolveUnsupportedPass()], jobs).run(self)
 
     def strip(self):
-        print("stripping comments")
-        for glo in self:
-            glo.strip()
+        PassManager([StripPass()]).run(self)
 
     def print_glo(self, syntax, indent):
         print('-' * 80)
@@ -1218,55 +2595,37 @@ class GloList(list):
             print(glo.export(syntax=syntax, indent=indent))
             print('-' * 80)
 
-    def export_glo(self, basename, syntax, indent):
-        for n in range(len(self)):
-            glo = self[n]
-            filename = f'{basename}_{n + 1:02}.glo'
-            print(f'writing {filename}: {glo.get_duration()/resolution:.2f} seconds')
-            with open(filename, 'w') as f:
-                f.write(glo.export(syntax=syntax, indent=indent))
+    def export_glo(self, basename, syntax, indent, jobs=None):
+        self._map(_export_glo, [(glo, f'{basename}_{n + 1:02}.glo', syntax, indent) for n, glo in enumerate(self)], jobs)
 
-    def render_png(self, filename, resolution, stretch, padding, amplify):
+    def render_png(self, filename, resolution, stretch, padding, amplify, jobs=None):
         print(f'exporting png: resolution={resolution}, stretch={stretch}, padding={padding}, amplify={amplify}')
 
-        rows = []
-
-        for p in range(padding):
-            rows.append([])
-
-        for glo in self:
-            rows_x = []
-            for i in range(resolution):
-                rows_x.append([])
-
-            row = 0
-            for c in glo.render():
-                rows_x[row].extend(c.get_rgb(amplify))
-                row += 1
-                if row >= resolution:
-                    row = 0
-
-            for row in rows_x:
-                for r in range(stretch):
-                    rows.append(row)
-
-            for p in range(padding):
-                rows.append([])
-
-        max_len = max(len(r) for r in rows)
-        for i in range(len(rows)):
-            while len(rows[i]) < max_len:
-                rows[i].extend([0, 0, 0])
-
-        height = len(rows)
-        width = len(rows[0]) // 3
+        width = max((-(-glo.get_duration() // resolution) for glo in self), default=0)
+        height = padding + len(self) * (resolution * stretch + padding)
 
         print(f'writing {filename}: {width} x {height} px')
 
-        f = open(filename, 'wb')
-        w = png.Writer(width, height, greyscale=False)
-        w.write(f, rows)
-        f.close()
+        with open(filename, 'wb') as f:
+            w = png.Writer(width, height, greyscale=False)
+            w.write(f, self._png_rows(width, resolution, stretch, padding, amplify, jobs))
+
+    def _png_rows(self, width, resolution, stretch, padding, amplify, jobs):
+        # only the render of the prop being written is in memory, with jobs also the renders of up to jobs props in flight,
+        # each pixel column holds resolution ticks one below the other
+        empty = np.zeros(width * 3, dtype=np.uint8)
+        yield from itertools.repeat(empty, padding)
+
+        for colors in self._imap(_render_glo, [(glo, amplify) for glo in self], jobs):
+            for r in range(resolution):
+                # strided view of the ticks of this row, copied into a row padded to the image width
+                row = np.zeros((width, 3), dtype=np.uint8)
+                column = colors[r::resolution]
+                row[:len(column)] = column
+                yield from itertools.repeat(row.reshape(-1), stretch)
+            # the render is released before the next one is taken
+            del colors, column, row
+            yield from itertools.repeat(empty, padding)
 
     def _create_bars(self, slice, bar_width):
         row = []
@@ -1286,18 +2645,21 @@ class GloList(list):
         slices = self._get_slices(color_slices, slice_min, slice_max)
         png_writer.write(pipe, list(self._create_bars(slice, bar_width) for slice in slices))
 
-    def render_video(self, filename, amplify=False, time_start=0, fps=30, window=10, bar_width=4, audio_file=None, width=640, height=360, preset='fast'):
+    def render_video(self, filename, amplify=False, time_start=0, fps=30, window=10, bar_width=4, audio_file=None, width=640, height=360, preset='fast', jobs=None):
         num = len(self)
-        colors = list(n.render().get_rgb(amplify) for n in self)
-        max_length = max(len(n) for n in colors)
+        max_length = max(n.get_duration() for n in self)
+
+        # only render what is visible from the first frame on
+        tick_start = max(int(time_start * fps) * resolution // fps - window + 1, 0)
+        colors = list(c.tolist() for c in self._map(_render_glo_range, [(n, tick_start, max_length, amplify) for n in self], jobs))
 
         # fill all up to max length
         for n in colors:
-            for t in range(max_length - len(n)):
+            for t in range(max_length - tick_start - len(n)):
                 n.append((0, 0, 0))
 
         color_slices = []
-        for t in range(max_length):
+        for t in range(max_length - tick_start):
             color_slices.append(list(colors[n][t] for n in range(num)))
         # add a black slice in the end
         color_slices.append(list((0, 0, 0) for n in range(num)))
@@ -1344,7 +2706,7 @@ class GloList(list):
 
         with Popen(args, stdin=PIPE) as pipe:
             for frame in range(frames_end):
-                t = frame * resolution // fps
+                t = frame * resolution // fps - tick_start
                 self._write_png(color_slices, t - window + 1, t + 1, bar_width, w, pipe.stdin)
 
 
@@ -1354,17 +2716,25 @@ def get_arguments():
     parser = argparse.ArgumentParser()
 
     group_input = parser.add_mutually_exclusive_group(required=True)
-    group_input.add_argument('-input', help='glo input file(s)', dest='input_files', nargs="+", metavar='FILE')
+    group_input.add_argument('-input', help='glo input file(s), - for stdin', dest='input_files', nargs="+", metavar='FILE')
     group_input.add_argument('-import-png', help='png input file', dest='import_png_file', metavar='FILE')
     group_input.add_argument('-convert-labels', help='convert labels', dest='labels_convert', nargs=2, metavar='FILE')
 
     parser.add_argument('-debug', help='enable debug output', dest='debug', action='store_true')
+    parser.add_argument('-jobs', help='number of processes for work on single props', dest='jobs', type=int, default=1, metavar='N')
+    parser.add_argument('-timing', help='print time spent per pass', dest='timing', action='store_true')
+    parser.add_argument('-debug-cache', help='verify cached values against a recomputation', dest='debug_cache', action='store_true')
 
     group_import_file = parser.add_argument_group('glo file import')
     group_import_file.add_argument('-number', help='split to number of sequences', dest='number', type=int, default=None)
+    group_import_file.add_argument('-cache', help='cache directory for imported files (default: $AEROPY_CACHE)', dest='cache_directory', default=os.environ.get('AEROPY_CACHE'), metavar='DIR')
+    group_import_file.add_argument('-cache-size', help='maximum cache size in MiB', dest='cache_size', type=int, default=256, metavar='MIB')
+    group_import_file.add_argument('-cache-clear', help='remove all cache entries before importing', dest='cache_clear', action='store_true')
+    group_import_file.add_argument('-no-cache', help='do not use the cache', dest='cache_directory', action='store_const', const=None)
 
     group_import_png = parser.add_argument_group('png file import')
     group_import_png.add_argument('-import-png-ramps', help=argparse.SUPPRESS, dest='import_png_ramps', action='store_true')
+    group_import_png.add_argument('-import-png-epsilon', help='fit ramps while importing, maximum color distance', dest='import_png_epsilon', type=float, default=None, metavar='DISTANCE')
 
     group_convert = parser.add_argument_group('labels conversion')
     group_convert.add_argument('-labels-format', help='labels conversion output format', dest='labels_convert_format', default='audacity', choices=['audacity', 'markers'])
@@ -1377,7 +2747,10 @@ def get_arguments():
     group_output.add_argument('-output', help='output file basename', dest='output_file', metavar='BASENAME')
     group_output.add_argument('-resolve', help='resolve constants', dest='resolve_constants', action='store_true')
     group_output.add_argument('-compress', help='compress command sequences', dest='compress', action='store_true')
+    group_output.add_argument('-compress-algorithm', help='algorithm for repetition compression', dest='compress_algorithm', default='ngram', choices=['ngram', 'repair'])
+    group_output.add_argument('-compress-ramp-algorithm', help='algorithm for ramp compression', dest='compress_ramp_algorithm', default='douglas-peucker', choices=['douglas-peucker', 'greedy'])
     group_output.add_argument('-epsilon', help='maximum color distance for ramp compression', dest='compress_epsilon', type=float, default=1.0, metavar='DISTANCE')
+    group_output.add_argument('-deduplicate', help='merge identical subs', dest='deduplicate', action='store_true')
     group_output.add_argument('-unsupported', help='resolve unsupported commands', dest='resolve_unsupported', action='store_true')
     group_output.add_argument('-syntax', help='command syntax to use', dest='syntax', nargs="+", default=[], choices=['legacy', 'british', 'camel', 'call'])
     group_output.add_argument('-tab', help='indention characters', dest='indent', type=int, default=2, metavar='SPACES')
@@ -1407,6 +2780,9 @@ def main():
     global debug
     debug = args.debug
 
+    global debug_cache
+    debug_cache = args.debug_cache
+
     glo_list = GloList()
 
     if args.labels_convert:
@@ -1416,33 +2792,51 @@ def main():
     else:
 
         if args.input_files:
+            cache = None
+            if args.cache_directory:
+                cache = FileCache(args.cache_directory, max_size=args.cache_size * 1024 * 1024)
+                if args.cache_clear:
+                    cache.clear()
+
             glo_list.import_files(
                 files=args.input_files,
-                split_number=args.number
+                split_number=args.number,
+                cache=cache
             )
 
         elif args.import_png_file:
             glo_list.import_png(
                 filename=args.import_png_file,
-                ramps=args.import_png_ramps
+                ramps=args.import_png_ramps,
+                epsilon=args.import_png_epsilon
             )
 
+        passes = PassManager(jobs=args.jobs, statistics=args.timing)
+
         if args.labels_files:
-            glo_list.apply_labels(Labels(args.labels_files))
+            passes.add(LabelsPass(Labels(args.labels_files)))
 
         if args.resolve_constants:
-            glo_list.resolve_constants()
+            passes.add(ResolveConstantsPass())
 
         if args.compress:
-            glo_list.compress(
-                options={'epsilon': args.compress_epsilon}
-            )
+            passes.add(CompressPass(
+                options={'epsilon': args.compress_epsilon, 'algorithm': args.compress_algorithm, 'ramp_algorithm': args.compress_ramp_algorithm}
+            ))
+
+        if args.deduplicate:
+            passes.add(DeduplicatePass())
 
         if args.resolve_unsupported:
-            glo_list.resolve_unsupported()
+            passes.add(ResolveUnsupportedPass())
 
         if args.strip:
-            glo_list.strip()
+            passes.add(StripPass())
+
+        passes.run(glo_list)
+
+        if args.timing:
+            passes.print_timing()
 
         if args.print:
             glo_list.print_glo(
@@ -1454,7 +2848,8 @@ def main():
             glo_list.export_glo(
                 basename=args.output_file,
                 syntax=args.syntax,
-                indent=args.indent
+                indent=args.indent,
+                jobs=args.jobs
             )
 
         if args.png_output_file:
@@ -1463,7 +2858,8 @@ def main():
                 resolution=args.png_output_resolution,
                 stretch=args.png_output_stretch,
                 padding=args.png_output_padding,
-                amplify=args.amplify
+                amplify=args.amplify,
+                jobs=args.jobs
             )
 
         if args.video_output_file:
@@ -1477,7 +2873,8 @@ def main():
                 audio_file=args.video_output_audio_file,
                 width=args.video_output_width,
                 height=args.video_output_height,
-                preset=args.video_preset
+                preset=args.video_preset,
+                jobs=args.jobs
             )
 
 if __name__ == "__main__":
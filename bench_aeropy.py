@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+
+import argparse
+import io
+import os
+import random
+import tempfile
+import time
+
+from aeropy import GloList
+
+
+def generate_glo(lines, seed=0):
+    # mix of all syntax variants the parser has to handle
+    rng = random.Random(seed)
+    glo = ['#define RED 255, 0, 0', '#define BLUE 0, 0, 255 ; constant']
+    n = 0
+    while n < lines:
+        r = rng.random()
+        if r < 0.3:
+            glo.append(f'color ({rng.randrange(256)}, {rng.randrange(256)}, {rng.randrange(256)})')
+        elif r < 0.5:
+            glo.append(f'C, {rng.randrange(256)}, {rng.randrange(256)}, {rng.randrange(256)} ; legacy')
+        elif r < 0.7:
+            glo.append(f'delay ({rng.randrange(1, 100)})')
+        elif r < 0.8:
+            glo.append(f'ramp ({rng.randrange(256)}, {rng.randrange(256)}, {rng.randrange(256)}, {rng.randrange(1, 100)})  ; ramp')
+        elif r < 0.9:
+            glo.append(rng.choice(['color (RED)', 'color (BLUE)']))
+        else:
+            glo.append('; comment')
+        n += 1
+    glo.append('end')
+    return '\n'.join(glo) + '\n'
+
+
+def generate_show(commands, seed=0):
+    # random sequence of a few motifs, like the choreography of a real show
+    rng = random.Random(seed)
+    motifs = []
+    for _ in range(12):
+        motif = []
+        for _ in range(rng.randrange(2, 8)):
+            motif.append(f'color ({rng.choice([0, 255])}, {rng.choice([0, 128, 255])}, {rng.choice([0, 255])})')
+            motif.append(f'delay ({rng.choice([5, 10, 25, 50])})')
+        motifs.append(motif)
+    glo = []
+    while len(glo) < commands:
+        glo.extend(rng.choice(motifs) * rng.choice([1, 1, 2, 4]))
+    return '\n'.join(glo[:commands] + ['end']) + '\n'
+
+
+def benchmark(name, function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    print(f'{name}: {min(times) * 1000:.1f} ms (best of {repeat})')
+    return min(times), result
+
+
+def bench_parse(args):
+    glo = generate_glo(args.lines)
+    t, _ = benchmark(f'parse {args.lines} lines', lambda: GloList()._import_glo(io.StringIO(glo)), args.repeat)
+    print(f'  {args.lines / t:.0f} lines/s')
+
+
+def bench_split(args):
+    # every fifth line is specific to a single prop
+    lines = generate_glo(args.lines).split('\n')
+    for n in range(len(lines) - 3, 2, -5):
+        lines[n: n + 1] = [f'<{n % args.props + 1}>', lines[n], '<end>']
+    with tempfile.NamedTemporaryFile('w', suffix='.glo', delete=False) as f:
+        f.write('\n'.join(lines))
+    try:
+        benchmark(f'split {args.lines} lines for {args.props} props', lambda: GloList().import_files([f.name], args.props), args.repeat)
+    finally:
+        os.remove(f.name)
+
+
+def bench_repeat(args):
+    glo = generate_show(args.commands)
+
+    for algorithm in ('ngram', 'repair'):
+        def compress():
+            f = GloList()._import_glo(io.StringIO(glo))
+            main = f.get_main()
+            if algorithm == 'repair':
+                main._compress_repair(f)
+            else:
+                main._compress_repeat(f)
+            return f
+
+        _, f = benchmark(f'repetition compression ({algorithm}) of {args.commands} commands', compress, args.repeat)
+        commands = len(f.get_main()) + sum(len(sub) + 1 for sub in f[1:])
+        print(f'  {commands} commands ({commands / args.commands:.1%}), {len(f) - 1} subs')
+
+
+def generate_fades(commands, seed=0):
+    # smooth fades with a little noise, held colors and hard cuts
+    rng = random.Random(seed)
+    color = [0, 0, 0]
+    glo = [f'color ({color[0]}, {color[1]}, {color[2]})']
+    while len(glo) < commands:
+        r = rng.random()
+        if r < 0.05:
+            color = [rng.randrange(256) for _ in color]
+        elif r < 0.1:
+            glo.append(f'delay ({rng.randrange(10, 100)})')
+            continue
+        else:
+            step = [rng.randint(-4, 4) for _ in color]
+            color = [min(255, max(0, c + s + rng.randint(-1, 1))) for c, s in zip(color, step)]
+        glo.append(f'color ({color[0]}, {color[1]}, {color[2]})')
+        glo.append(f'delay ({rng.choice([1, 1, 2, 5])})')
+    return '\n'.join(glo[:commands] + ['end']) + '\n'
+
+
+def bench_ramps(args):
+    glo = generate_fades(args.commands)
+
+    for algorithm in ('douglas-peucker', 'greedy'):
+        for epsilon in args.epsilon:
+            # only the compression is timed
+            mains = []
+            for _ in range(args.repeat):
+                mains.append(GloList()._import_glo(io.StringIO(glo)).get_main())
+                mains[-1]._convert_to_ramps()
+
+            def compress():
+                main = mains.pop()
+                if algorithm == 'greedy':
+                    e_max = main._compress_ramp_fit(epsilon)
+                else:
+                    e_max = main._compress_douglas_peucker(0, len(main) - 1, epsilon)
+                return len(main), e_max
+
+            _, (length, e_max) = benchmark(f'ramp compression ({algorithm}, epsilon {epsilon}) of {args.commands} commands', compress, args.repeat)
+            print(f'  {length} ramps, max error {e_max:.2f}')
+
+
+def generate_gradient(commands, seed=0):
+    # slow fade with noise, a single ramp within a large epsilon
+    rng = random.Random(seed)
+    glo = ['color (0, 0, 0)']
+    for i in range(commands // 2):
+        c = [min(255, max(0, i * 200 // (commands // 2) + rng.randint(-10, 10))) for _ in range(3)]
+        glo.append(f'color ({c[0]}, {c[1]}, {c[2]})')
+        glo.append('delay (1)')
+    return '\n'.join(glo[:commands] + ['end']) + '\n'
+
+
+def bench_ramp_scaling(args):
+    for algorithm in ('douglas-peucker', 'greedy'):
+        for factor in (1, 2, 4, 8):
+            commands = args.commands * factor
+            glo = generate_gradient(commands)
+            # only the compression is timed
+            mains = []
+            for _ in range(args.repeat):
+                mains.append(GloList()._import_glo(io.StringIO(glo)).get_main())
+                mains[-1]._convert_to_ramps()
+
+            def compress():
+                main = mains.pop()
+                if algorithm == 'greedy':
+                    main._compress_ramp_fit(30)
+                else:
+                    main._compress_douglas_peucker(0, len(main) - 1, 30)
+                return len(main)
+
+            t, length = benchmark(f'ramp compression ({algorithm}, epsilon 30) of {commands} noisy gradient commands', compress, args.repeat)
+            print(f'  {length} ramps, {t / commands * 1e6:.2f} us/command')
+
+
+def generate_flat(commands, seed=0):
+    # long flat sequence like a png import, with comments and time marks
+    rng = random.Random(seed)
+    glo = []
+    time = 0
+    while len(glo) < commands:
+        r = rng.random()
+        if r < 0.4:
+            glo.append(f'color ({rng.randrange(256)}, {rng.randrange(256)}, {rng.randrange(256)})')
+        elif r < 0.8:
+            duration = rng.choice([0, 1, 2, 70000])
+            glo.append(f'delay ({duration})')
+            time += duration
+        elif r < 0.95:
+            glo.append('; comment')
+        else:
+            time += 10
+            glo.append(f'time (set, {time})')
+    return glo[:commands] + ['end']
+
+
+def bench_rewrite(args):
+    passes = {
+        'strip': lambda f: f.strip(),
+        'resolve_unsupported': lambda f: f.resolve_unsupported(),
+        'compress_adjacent_delays': lambda f: f.get_main()._compress_adjacent_delays(),
+        'convert_to_ramps': lambda f: f.get_main()._convert_to_ramps(),
+        'shift_labels': lambda f: f.shift_labels(None),
+    }
+
+    for name, function in passes.items():
+        for factor in (1, 2, 4, 8):
+            commands = args.commands * factor
+            glo = generate_flat(commands)
+            # only the pass is timed
+            files = [GloList()._import_glo(glo) for _ in range(args.repeat)]
+            t, _ = benchmark(f'{name} of {commands} commands', lambda: function(files.pop()), args.repeat)
+            print(f'  {t / commands * 1e6:.2f} us/command')
+
+
+benchmarks = {
+    'parse': bench_parse,
+    'split': bench_split,
+    'repeat': bench_repeat,
+    'ramps': bench_ramps,
+    'ramp-scaling': bench_ramp_scaling,
+    'rewrite': bench_rewrite,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='aeropy benchmarks')
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK', help='benchmarks to run: {} (default: all)'.format(', '.join(benchmarks.keys())))
+    parser.add_argument('-lines', type=int, default=100000, help='number of lines of generated glo files')
+    parser.add_argument('-commands', type=int, default=2000, help='number of commands of generated shows')
+    parser.add_argument('-epsilon', type=float, nargs='+', default=[1.0, 5.0, 20.0], help='maximum color distances for ramp benchmarks')
+    parser.add_argument('-props', type=int, default=20, help='number of props for split benchmarks')
+    parser.add_argument('-repeat', type=int, default=3, help='number of runs per benchmark')
+    args = parser.parse_args()
+
+    for name in args.benchmarks or benchmarks.keys():
+        if name not in benchmarks:
+            parser.error(f'unknown benchmark: {name}')
+        benchmarks[name](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,19 @@
 #!/usr/bin/python3
 
 import unittest
+import unittest.mock
+import tempfile
+import os
 import io
+import contextlib
+import pickle
+import zlib
+import random
 
-from aeropy import Color, Labels, Arguments, LightCommandColor, LightCommandDelay, LightCommandRamp, LightCommandNoop, LightCommandSub, LightCommandDefine, LightSequence, LightSequenceLoop, LightSequenceDefsub, LightSequenceMain, LightSequenceFile, GloList
+import png
+
+import aeropy
+from aeropy import Color, Labels, Arguments, RenderCache, FileCache, LightCommandColor, LightCommandColorRed, LightCommandColorGreen, LightCommandColorBlue, LightCommandDelay, LightCommandRamp, LightCommandNoop, LightCommandSub, LightCommandDefine, LightSequence, LightSequenceLoop, LightSequenceDefsub, LightSequenceMain, LightSequenceFile, GloList, PassManager, ResolveConstantsPass, ResolveUnsupportedPass, StripPass, CompressPass, RampFitter
 
 
 class TestLabels(unittest.TestCase):
@@ -96,12 +106,34 @@ class TestColor(unittest.TestCase):
         c2 = Color(255, 0, 0)
         self.assertEqual(c1, c2)
 
+    def test_immutable(self):
+        c1 = Color.intern(255, 0, 0)
+        with self.assertRaises(AttributeError):
+            c1.red = 0
+        with self.assertRaises(AttributeError):
+            del c1.green
+        self.assertIs(Color.intern(255, 0, 0), c1)
+        self.assertEqual(c1.get_rgb(), (255, 0, 0))
+        self.assertEqual(pickle.loads(pickle.dumps(c1)), c1)
+
     def test_or(self):
         c1 = Color(255, None, None)
         c2 = Color(10, 20, None)
         cr = c1 | c2
         self.assertEqual(cr.get_rgb(), (255, 20, None))
 
+    def test_interpolate(self):
+        c1 = Color(10, 20, 30)
+        c2 = Color(110, 120, 130)
+        self.assertEqual(c1.interpolate(c2, 0.25), c1 * 0.75 + c2 * 0.25)
+        self.assertEqual(round(c1.interpolate(c2, 0.5)).get_rgb(), (60, 70, 80))
+
+    def test_intern(self):
+        self.assertIs(Color.intern(255, 0, 255), Color.intern(255, 0, 255))
+        self.assertEqual(Color.intern(1, 2, 3), Color(1, 2, 3))
+        self.assertEqual(hash(Color.intern(1, 2, 3)), hash(Color(1, 2, 3)))
+        self.assertFalse(hasattr(Color(), '__dict__'))
+
     def test_amplify(self):
         c = Color(10, 20, 30)
         self.assertEqual(c.get_rgb(amplify=True), (50, 71, 87))
@@ -139,6 +171,15 @@ class TestArguments(unittest.TestCase):
         self.assertEqual(a3._expand(), [4, 5, 6, 10])
         self.assertEqual(a4._expand(), [4, 5, 6, 20])
 
+    def test_arguments_modified(self):
+        a1 = Arguments([4, 5, 6], name="a1")
+        a2 = Arguments([a1, 10])
+        self.assertEqual((len(a2), a2[3]), (4, 10))
+        a1[0] = 7
+        self.assertEqual(a2._expand(), [7, 5, 6, 10])
+        self.assertEqual(hash(a2), hash(Arguments([7, 5, 6, 10])))
+        self.assertEqual(str(a2), "a1, 10")
+
 
 class TestLightObject(unittest.TestCase):
     color_pre = Color(10, 20, 30)
@@ -194,6 +235,211 @@ class TestLightObject(unittest.TestCase):
         self.assertEqual(f.get_duration(), 6)
 
 
+class Test_render_array(unittest.TestCase):
+    def test_render_array(self):
+        ds = LightSequenceDefsub(arguments=Arguments(['sub_name']), objects=[
+            LightCommandRamp(arguments=Arguments([200, 100, 0, 7])),
+            LightCommandDelay(arguments=Arguments([3]))
+        ])
+        m = LightSequenceMain(objects=[
+            LightCommandColor(arguments=Arguments([10, 20, 30])),
+            LightCommandDelay(arguments=Arguments([2])),
+            LightSequenceLoop(arguments=Arguments([3]), objects=[
+                LightCommandSub(arguments=Arguments(['sub_name'])),
+                LightCommandColorRed(arguments=Arguments([5])),
+                LightCommandDelay(arguments=Arguments([1]))
+            ])
+        ])
+        f = LightSequenceFile(objects=[m, ds])
+
+        colors = m._render_connected(Color(), f)[0]
+        array = f.render_array()
+        self.assertEqual(array.shape, (35, 3))
+        self.assertEqual(array.tolist(), list(list(c.get_rgb()) for c in colors))
+        self.assertEqual(f.render_array(amplify=True).tolist(), list(list(c.get_rgb(amplify=True)) for c in colors))
+        self.assertEqual(f.render(), colors)
+
+    def test_render_loop(self):
+        body = [
+            LightCommandDelay(arguments=Arguments([2])),
+            LightCommandRamp(arguments=Arguments([100, 50, 0, 3])),
+            LightCommandColorRed(arguments=Arguments([250])),
+            LightCommandDelay(arguments=Arguments([1]))
+        ]
+        lo = LightSequenceMain(objects=[LightSequenceLoop(arguments=Arguments([4]), objects=body)])
+        unrolled = LightSequenceMain(objects=body * 4)
+        colors = unrolled._render_connected(Color(1, 2, 3), None)
+
+        self.assertEqual(lo._render_connected(Color(1, 2, 3), None), colors)
+        self.assertEqual(lo.render_array(color_pre=Color(1, 2, 3)).tolist(), list(list(c.get_rgb()) for c in colors[0]))
+        self.assertEqual(lo.render_segments(color_pre=Color(1, 2, 3)).render_array().tolist(), list(list(c.get_rgb()) for c in colors[0]))
+
+    def test_render_range(self):
+        ds = LightSequenceDefsub(arguments=Arguments(['sub_name']), objects=[
+            LightCommandRamp(arguments=Arguments([200, 100, 0, 7])),
+            LightCommandDelay(arguments=Arguments([3]))
+        ])
+        m = LightSequenceMain(objects=[
+            LightCommandColor(arguments=Arguments([10, 20, 30])),
+            LightCommandDelay(arguments=Arguments([2])),
+            LightSequenceLoop(arguments=Arguments([6]), objects=[
+                LightCommandColorBlue(arguments=Arguments([90])),
+                LightCommandRamp(arguments=Arguments([5, 5, 5, 2])),
+                LightCommandSub(arguments=Arguments(['sub_name'])),
+                LightCommandColorRed(arguments=Arguments([5])),
+                LightCommandDelay(arguments=Arguments([1]))
+            ])
+        ])
+        f = LightSequenceFile(objects=[m, ds])
+
+        array = f.render_array()
+        for (time_start, time_end) in ((0, 80), (-5, 3), (1, 2), (13, 14), (14, 15), (20, 60), (75, 100), (100, 120)):
+            self.assertEqual(f.render_range(time_start, time_end).tolist(), array[max(time_start, 0): time_end].tolist())
+
+    def test_render_sub_cache(self):
+        ds = LightSequenceDefsub(arguments=Arguments(['sub_name']), objects=[
+            LightCommandRamp(arguments=Arguments([200, 100, 0, 4])),
+            LightCommandColor(arguments=Arguments([0, 0, 0]))
+        ])
+        m = LightSequenceMain(objects=list(LightCommandSub(arguments=Arguments(['sub_name'])) for n in range(5)))
+        f = LightSequenceFile(objects=[m, ds])
+
+        array = f.render_array()
+        self.assertEqual((f.sub_cache.hits, f.sub_cache.misses), (4, 1))
+        self.assertEqual(array.tolist(), list(list(c.get_rgb()) for c in m._render_connected(Color(), f)[0]))
+
+        ds.append(LightCommandDelay(arguments=Arguments([1])))
+        self.assertEqual(len(f.render_array()), 25)
+        self.assertEqual((f.sub_cache.hits, f.sub_cache.misses), (8, 2))
+        # entries only live for one render
+        self.assertEqual(len(f.sub_cache), 0)
+
+        # subs called once are not cached
+        f = LightSequenceFile(objects=[LightSequenceMain(objects=[LightCommandSub(arguments=Arguments(['sub_name']))]), ds])
+        self.assertEqual(len(f.render_array()), 5)
+        self.assertEqual((f.sub_cache.hits, f.sub_cache.misses), (0, 0))
+
+    def test_render_cache_lru(self):
+        cache = RenderCache(max_size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_render_segments(self):
+        m = LightSequenceMain(objects=[
+            LightCommandColor(arguments=Arguments([10, 20, 30])),
+            LightCommandDelay(arguments=Arguments([2])),
+            LightCommandDelay(arguments=Arguments([3])),
+            LightSequenceLoop(arguments=Arguments([2]), objects=[
+                LightCommandRamp(arguments=Arguments([110, 120, 130, 4])),
+                LightCommandColor(arguments=Arguments([10, 20, 30]))
+            ])
+        ])
+        f = LightSequenceFile(objects=[m])
+
+        segments = f.render_segments()
+        self.assertEqual(segments, [
+            (0, 5, Color(10, 20, 30), Color(10, 20, 30)),
+            (5, 4, Color(10, 20, 30), Color(110, 120, 130)),
+            (9, 4, Color(10, 20, 30), Color(110, 120, 130))
+        ])
+        self.assertEqual(segments.get_duration(), 13)
+        self.assertEqual(segments.render_array().tolist(), f.render_array().tolist())
+
+    def test_render_png(self):
+        g = GloList()
+        g.append(g._import_glo(['color (10, 20, 30)', 'delay (5)', 'end']))
+        g.append(g._import_glo(['color (1, 2, 3)', 'delay (2)', 'end']))
+        a, b, z = [10, 20, 30], [1, 2, 3], [0, 0, 0]
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'test.png')
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                g.render_png(filename, resolution=2, stretch=2, padding=1, amplify=False)
+            width, height, rows, _ = png.Reader(filename=filename).read()
+            rows = [list(row) for row in rows]
+        self.assertEqual(output.getvalue().splitlines()[-1], f'writing {filename}: 3 x 11 px')
+        self.assertEqual((width, height), (3, 11))
+        self.assertEqual(rows, [z * 3] + [a * 3] * 2 + [a * 2 + z] * 2 + [z * 3] + [b + z * 2] * 4 + [z * 3])
+
+    def test_render_png_sub_cache(self):
+        # no render of a prop is kept after its band is written
+        g = GloList()
+        for n in range(2):
+            g.append(g._import_glo([f'color ({n}, 2, 3)', 'sub (s1)', 'sub (s1)', 'end', 'defsub (s1)', f'color ({n}, 2, 3)', 'delay (3)', 'endsub']))
+        with tempfile.TemporaryDirectory() as tmp:
+            with contextlib.redirect_stdout(io.StringIO()):
+                g.render_png(os.path.join(tmp, 'test.png'), resolution=2, stretch=1, padding=0, amplify=False)
+        self.assertEqual([(len(glo.sub_cache), glo.sub_cache.hits, glo.sub_cache.misses) for glo in g], [(0, 1, 1), (0, 1, 1)])
+
+    def test_render_png_rows(self):
+        # props are rendered when their band is written
+        g = GloList()
+        g.append(g._import_glo(['color (10, 20, 30)', 'delay (5)', 'end']))
+        g.append(g._import_glo(['color (1, 2, 3)', 'delay (2)', 'end']))
+        with unittest.mock.patch('aeropy._render_glo', wraps=aeropy._render_glo) as render:
+            rows = g._png_rows(3, 2, 2, 1, False, None)
+            self.assertEqual([list(next(rows)) for _ in range(5)], [[0] * 9] + [[10, 20, 30] * 3] * 2 + [[10, 20, 30] * 2 + [0] * 3] * 2)
+            self.assertEqual(render.call_count, 1)
+            self.assertEqual(len(list(rows)), 6)
+            self.assertEqual(render.call_count, 2)
+
+
+class Test_duration_cache(unittest.TestCase):
+    def test_duration_cache(self):
+        inner = LightSequenceLoop(arguments=Arguments([3]), objects=[LightCommandDelay(arguments=Arguments([2]))])
+        ds = LightSequenceDefsub(arguments=Arguments(['sub_name']), objects=[inner])
+        m = LightSequenceMain(objects=[
+            LightCommandSub(arguments=Arguments(['sub_name'])),
+            LightSequenceLoop(arguments=Arguments([2]), objects=[LightCommandSub(arguments=Arguments(['sub_name']))])
+        ])
+        f = LightSequenceFile(objects=[m, ds])
+
+        self.assertEqual(f.get_duration(), 18)
+        self.assertEqual(m._duration_cache[2], 18)
+
+        inner.append(LightCommandDelay(arguments=Arguments([1])))
+        self.assertEqual(f.get_duration(), 27)
+        m[1].arguments[0] = 1
+        self.assertEqual(f.get_duration(), 18)
+
+        aeropy.debug_cache = True
+        try:
+            self.assertEqual(f.get_duration(), 18)
+            m._duration_cache = (m._duration_cache[0], f, 17)
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertRaises(ValueError, f.get_duration)
+        finally:
+            aeropy.debug_cache = False
+
+
+    def test_color_change_cache(self):
+        inner = LightSequenceDefsub(arguments=Arguments(['inner']), objects=[LightCommandColorRed(arguments=Arguments([10])), LightCommandDelay(arguments=Arguments([2]))])
+        outer = LightSequenceDefsub(arguments=Arguments(['outer']), objects=[LightCommandSub(arguments=Arguments(['inner'])), LightCommandColorBlue(arguments=Arguments([30]))])
+        m = LightSequenceMain(objects=[LightCommandSub(arguments=Arguments(['outer'])), LightCommandSub(arguments=Arguments(['outer']))])
+        f = LightSequenceFile(objects=[m, outer, inner])
+
+        self.assertEqual(m._color_change(f), Color(10, None, 30))
+        self.assertEqual(f.sub_color_changes, {'inner': Color(10, None, None), 'outer': Color(10, None, 30)})
+        self.assertEqual(f.render_range(1, 4).tolist(), f.render_array()[1: 4].tolist())
+
+        inner.append(LightCommandColorGreen(arguments=Arguments([20])))
+        self.assertEqual(m._color_change(f), Color(10, 20, 30))
+
+        aeropy.debug_cache = True
+        try:
+            self.assertEqual(m._color_change(f), Color(10, 20, 30))
+            f.sub_color_changes['outer'] = Color(1, 2, 3)
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertRaises(ValueError, m._color_change, f)
+        finally:
+            aeropy.debug_cache = False
+
+
 class Test_define(unittest.TestCase):
     def test_define(self):
         arguments = Arguments(name="DEF_NAME", objects=[1, 2, 3])
@@ -279,6 +525,192 @@ class Test_merge(unittest.TestCase):
         self.assertEqual(glo1.export(), '\n'.join(self.test_output))
 
 
+class Test_deduplicate(unittest.TestCase):
+    test_file1 = (
+        "sub (a)",
+        "sub (c)",
+        "loop (2)",
+        "sub (b)",
+        "endloop",
+        "sub (d)",
+        "end",
+        "defsub (a)",
+        "color (1, 2, 3)",
+        "delay (5)",
+        "endsub",
+        "defsub (b)",
+        "color (1, 2, 3) ; same as a",
+        "delay (5)",
+        "endsub",
+        "defsub (c)",
+        "sub (a)",
+        "delay (1)",
+        "endsub",
+        "defsub (d)",
+        "sub (b)",
+        "delay (1)",
+        "endsub"
+    )
+    test_file2 = (
+        "sub (x)",
+        "end",
+        "defsub (x)",
+        "color (1, 2, 3)",
+        "delay (5)",
+        "endsub"
+    )
+    test_output = (
+        "sub (a)",
+        "sub (c)",
+        "loop (2)",
+        "  sub (a)",
+        "endloop",
+        "sub (c)",
+        "end",
+        "defsub (a)",
+        "  color (1, 2, 3)",
+        "  delay (5)",
+        "endsub",
+        "defsub (c)",
+        "  sub (a)",
+        "  delay (1)",
+        "endsub"
+    )
+
+    def test_deduplicate(self):
+        g = GloList()
+        g.append(g._import_glo(self.test_file1))
+        g.append(g._import_glo(self.test_file2))
+        duration = g[0].get_duration()
+
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            g.deduplicate()
+
+        self.assertEqual(g[0].export(indent=2), '\n'.join(self.test_output))
+        self.assertEqual(g[0].get_duration(), duration)
+        self.assertEqual(output.getvalue().splitlines()[1:], [
+            '#01 - removed 2 subs (6 commands), 1 of 2 subs shared with other sequences',
+            '#02 - removed 0 subs (0 commands), 1 of 1 subs shared with other sequences'
+        ])
+
+
+class Test_pass_manager(unittest.TestCase):
+    test_file = (
+        "#define RED 255, 0, 0",
+        "color (RED) ; red",
+        "; comment",
+        "loop (2)",
+        "delay (5)",
+        "; comment",
+        "endloop",
+        "end"
+    )
+
+    def test_groups(self):
+        passes = [ResolveConstantsPass(), StripPass(), ResolveUnsupportedPass(), StripPass(), CompressPass({}), ResolveConstantsPass()]
+        groups = PassManager(passes)._groups()
+        self.assertEqual([[p.name for p in group] for group in groups], [['resolve constants', 'strip'], ['resolve unsupported'], ['strip'], ['compress'], ['resolve constants']])
+
+    def test_run(self):
+        g = GloList()
+        g.append(g._import_glo(self.test_file))
+        passes = PassManager([ResolveConstantsPass(), StripPass()])
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            passes.run(g)
+        self.assertEqual(output.getvalue(), 'resolving constants\nstripping comments\n')
+        self.assertEqual(g[0].export(), 'color (255, 0, 0)\nloop (2)\ndelay (5)\nendloop\nend')
+        self.assertEqual([(p.visited, p.changed) for p in passes.passes], [(7, 2), (7, 4)])
+
+    def test_jobs(self):
+        results = []
+        for jobs in (None, 2):
+            g = GloList()
+            g.append(g._import_glo(self.test_file))
+            g.append(g._import_glo(self.test_file))
+            passes = PassManager([ResolveConstantsPass(), StripPass(), CompressPass({'epsilon': 1})], jobs, statistics=True)
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                passes.run(g)
+            results.append(([glo.export() for glo in g], output.getvalue(), [(p.visited, p.changed) for p in passes.passes]))
+        self.assertEqual(results[0], results[1])
+
+    def test_statistics(self):
+        # whole tree passes only count nodes when asked to
+        for statistics, visited in ((False, 0), (True, 8)):
+            g = GloList()
+            g.append(g._import_glo(self.test_file))
+            passes = PassManager([CompressPass({'epsilon': 1})], statistics=statistics)
+            with contextlib.redirect_stdout(io.StringIO()):
+                passes.run(g)
+            self.assertEqual(passes.passes[0].visited, visited)
+
+    def test_jobs_error(self):
+        # props after a failing one are not started
+        g = GloList()
+        g.append(LightSequenceFile(objects=[LightSequenceMain(objects=[LightCommandSub(arguments=Arguments(['missing']))])]))
+        for n in range(4):
+            g.append(g._import_glo(['delay (100)', 'end']))
+        with tempfile.TemporaryDirectory() as tmp:
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                self.assertRaises(ValueError, g.export_glo, os.path.join(tmp, 'test'), 'default', 4, jobs=2)
+            self.assertEqual(output.getvalue().splitlines()[0], 'ERROR: sub not found missing')
+            self.assertLessEqual(len(os.listdir(tmp)), 1)
+
+
+class Test_check(unittest.TestCase):
+    def test_check_arguments(self):
+        LightCommandRamp(arguments=Arguments([1, 2, 3, 4]))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertRaises(ValueError, LightCommandRamp, arguments=Arguments([1, 2, 'a', 4]))
+            self.assertRaises(ValueError, LightCommandRamp, arguments=Arguments([1, 2, 3]))
+        LightCommandRamp(arguments=Arguments([1, 2, 3]), check=False)
+
+    def test_check_objects(self):
+        m = LightSequenceMain()
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertRaises(ValueError, m.append, LightSequenceMain())
+        self.assertEqual(output.getvalue(), "ERROR: object 'main' not allowed in 'main'\n")
+        m.append(LightSequenceMain(), check=False)
+        self.assertEqual(len(m), 1)
+
+
+class Test_get_sub(unittest.TestCase):
+    def test_get_sub(self):
+        ds1 = LightSequenceDefsub(arguments=Arguments(['sub1']))
+        ds2 = LightSequenceDefsub(arguments=Arguments(['sub2']))
+        ds3 = LightSequenceDefsub(arguments=Arguments(['sub1']))
+        f = LightSequenceFile(objects=[LightSequenceMain(), ds1])
+
+        self.assertIs(f.get_sub('sub1'), ds1)
+        f.append(ds2)
+        f.append(ds3)
+        self.assertIs(f.get_sub('sub2'), ds2)
+        self.assertIs(f.get_sub('sub1'), ds1)
+
+        f.add_namespace('G1_')
+        self.assertIs(f.get_sub('G1_sub2'), ds2)
+        ds2.add_namespace('X_')
+        self.assertIs(f.get_sub('X_G1_sub2'), ds2)
+        f.pop(1)
+        self.assertIs(f.get_sub('G1_sub1'), ds3)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertRaises(ValueError, f.get_sub, 'G1_sub2')
+
+    def test_import_lines(self):
+        lines = iter(['loop (2)', 'sub (sub1)', 'endloop', 'end', 'defsub (sub1)', 'delay (5)', 'endsub'])
+        f = GloList()._import_glo(lines)
+        self.assertEqual([o.name for o in f], ['main', 'defsub'])
+        self.assertEqual(f.get_duration(), 10)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertRaises(ValueError, GloList()._import_glo, ['end', 'defsub (sub1)', 'delay (5)'])
+        self.assertEqual(output.getvalue(), "ERROR: end of file reached in 'defsub'\n")
+
+    def test_undefined_sub(self):
+        glo_file = io.StringIO('sub (sub1)\nend\ndefsub (sub2)\nendsub\n')
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertRaises(ValueError, GloList()._import_glo, glo_file)
+        self.assertEqual(output.getvalue(), "ERROR: sub 'sub1' is called but not defined\n")
+
+
 class Test_resolve_unsupported(unittest.TestCase):
     def test_delay_zero(self):
         delay = LightCommandDelay(arguments=Arguments([0]), noop=" ; comment")
@@ -309,6 +741,88 @@ class Test_resolve_unsupported(unittest.TestCase):
         self.assertEqual(mains[3].export(), "loop (2); LOOP UNFOLD: 2 * 255 + 11 = 521\nloop (255)\ndelay (10)\nendloop\nendloop\nloop (11)\ndelay (10)\nendloop\nend")
 
 
+class Test_sequence_passes(unittest.TestCase):
+    # expected output of the passes before they were rewritten as single sweeps
+    test_file = (
+        '#define RED 255, 0, 0',
+        'color (RED) ; red',
+        '; comment',
+        'delay (0)',
+        'delay (5) ; five',
+        '; between',
+        'delay (7)',
+        'time (setref, label, a)',
+        'color (0, 0, 255)',
+        'time (set, 30)',
+        'delay (70000)',
+        'delay (2)',
+        'time (set, label, b, 10)',
+        'loop (2)',
+        'delay (3)',
+        '; in loop',
+        'delay (4)',
+        'endloop',
+        'ramp (0, 255, 0, 6)',
+        'end'
+    )
+    shifted = (
+        '; TIME REFERENCE (setref, label, a): old=0, new=20+0',
+        'color (0, 0, 255)',
+        '; TIME SHIFT (set, 30): time=12, target=20+30+0, add=38',
+        'delay (38)'
+    )
+    shifted_b = (
+        '; TIME SHIFT (set, label, b, 10): time=70052, target=20+70050+10, add=28',
+        'delay (28)'
+    )
+
+    def setUp(self):
+        self.labels = Labels()
+        self.labels._import(io.StringIO('0.2\t0.3\ta\n700.5\t701.0\tb\n'))
+        self.f = GloList()._import_glo(self.test_file)
+
+    def test_shift_labels(self):
+        self.f.shift_labels(self.labels)
+        lines = self.test_file
+        self.assertEqual(self.f.export().split('\n'), list(lines[:7] + self.shifted + lines[10:12] + self.shifted_b + lines[13:]))
+
+    def test_strip(self):
+        self.f.strip()
+        self.assertEqual(self.f.export().split('\n'), [line.split(' ;')[0] for line in self.test_file if not line.startswith(';')])
+
+    def test_resolve_unsupported(self):
+        self.f.shift_labels(self.labels)
+        self.f.resolve_unsupported()
+        lines = self.test_file
+        self.assertEqual(self.f.export().split('\n'), list(
+            lines[:3] + ('; DELAY RESOLVE: 0',) + lines[4:7] + self.shifted +
+            ('; DELAY RESOLVE: 70000', 'delay (65535)', 'delay (4465)', 'delay (2)') + self.shifted_b + lines[13:]
+        ))
+
+    def test_compress_adjacent_delays(self):
+        # delays separated by comments only are merged, the comments move before them
+        self.f.get_main()._compress_adjacent_delays()
+        lines = self.test_file
+        self.assertEqual(self.f.export().split('\n'), list(
+            lines[:3] + ('; between', 'delay (12) ; five') + lines[7:10] + ('delay (70002)',) + lines[12:]
+        ))
+
+    def test_convert_ramps(self):
+        lines = ['color (10, 20, 30) ; start', 'delay (0)', 'delay (1)', 'color (40, 50, 60)', 'delay (5) ; five', 'color (0, 0, 0)', 'color (1, 1, 1)', 'delay (70000)', 'ramp (9, 9, 9, 3)', 'delay (2)', 'color (9, 9, 9)', 'delay (1)', 'end']
+        f = GloList()._import_glo(lines)
+        m = f.get_main()
+        m._convert_to_ramps()
+        self.assertEqual([o.export() for o in m], [
+            'color (10, 20, 30) ; start', 'ramp (40, 50, 60, 1)', 'ramp (40, 50, 60, 4) ; five', 'ramp (0, 0, 0, 1)', 'ramp (1, 1, 1, 0)',
+            'ramp (1, 1, 1, 70000)', 'ramp (9, 9, 9, 3)', 'ramp (9, 9, 9, 1)', 'ramp (9, 9, 9, 1)', 'ramp (9, 9, 9, 1)'
+        ])
+        m._convert_from_ramps()
+        self.assertEqual([o.export() for o in m], [
+            'color (10, 20, 30) ; start', 'delay (1)', 'color (40, 50, 60)', 'delay (5) ; five', 'color (0, 0, 0)', 'color (1, 1, 1)',
+            'delay (70000)', 'ramp (9, 9, 9, 3)', 'delay (3)'
+        ])
+
+
 class Test_find_repeated_ngrams(unittest.TestCase):
     def test_find_repeated_ngrams(self):
         s = LightSequence()
@@ -316,6 +830,12 @@ class Test_find_repeated_ngrams(unittest.TestCase):
         self.assertEqual(s._find_repeated_ngrams([1, 1, 1, 1, 1]), {(1, 1): [0, 2]})
         self.assertEqual(s._find_repeated_ngrams([1, 1, 1, 1, 1, 1]), {(1, 1): [0, 2, 4], (1, 1, 1): [0, 3]})
 
+    def test_find_repeats(self):
+        s = LightSequence()
+        self.assertEqual(s._find_repeats([5, 1, 2, 5, 1, 2, 1, 2]), [(2, [0, 3]), (2, [1, 4, 6]), (3, [0, 3])])
+        self.assertEqual(s._find_repeats([1, 2, 3]), [])
+        self.assertEqual(s._find_repeats([]), [])
+
 
 class Test_find_repeated_ngrams_grouped(unittest.TestCase):
     def test_find_repeated_ngrams_grouped(self):
@@ -334,6 +854,98 @@ class Test_split_line(unittest.TestCase):
         self.assertEqual(GloList._split_line(None, "color ( 1, 2, 3)"), ('color', None, ' 1, 2, 3', None))
         self.assertEqual(GloList._split_line(None, "color ( 1 , 2 , 3 )"), ('color', None, ' 1 , 2 , 3', None))
         self.assertEqual(GloList._split_line(None, "#define NAME 1, 2, 3 ; comment"), ('#define', 'NAME', '1, 2, 3', ' ; comment'))
+        self.assertEqual(GloList._split_line(None, ";LABEL intro"), ('time', None, 'set, label, intro', None))
+        self.assertEqual(GloList._split_line(None, ";L-intro -25"), ('time', None, 'set, label, intro, -25', None))
+        self.assertEqual(GloList._split_line(None, ";LABEL intro ; comment"), ('noop', None, None, ';LABEL intro ; comment'))
+
+
+class Test_split_file(unittest.TestCase):
+    def test_split_file(self):
+        lines = ['#define C1 1, 2, 3', '<2>', '#define C1 4, 5, 6', '<end>', 'color (C1)', '<1,3>', 'delay (1)', '<default>', 'delay (2)', '<end>', 'end']
+        with unittest.mock.patch('sys.stdin', io.StringIO('\n'.join(lines))):
+            tokens = GloList()._split_file('-', 3)
+        self.assertEqual([len(t) for t in tokens], [4, 5, 4])
+        self.assertIs(tokens[0][0], tokens[1][0])
+        glos = [GloList()._import_tokens(t) for t in tokens]
+        self.assertEqual([g.render()[0].get_rgb() for g in glos], [(1, 2, 3), (4, 5, 6), (1, 2, 3)])
+        self.assertEqual([g.get_duration() for g in glos], [1, 2, 1])
+
+    def test_split_file_unused_block(self):
+        # lines for props beyond the number of props are not parsed
+        lines = ['color (1, 2, 3)', '<5>', 'not a command (', '<end>', 'delay (1)', 'end']
+        with unittest.mock.patch('sys.stdin', io.StringIO('\n'.join(lines))):
+            tokens = GloList()._split_file('-', 3)
+        self.assertEqual([len(t) for t in tokens], [3, 3, 3])
+
+
+class Test_file_cache(unittest.TestCase):
+    def test_file_cache(self):
+        lines = ['#define C1 1, 2, 3', 'loop (2)', 'sub (s1)', 'endloop', 'end', 'defsub (s1)', 'color (C1)', 'delay (5)', 'endsub']
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'test.glo')
+            with open(filename, 'w') as f:
+                f.write('\n'.join(lines))
+            cache = FileCache(os.path.join(directory, 'cache'))
+            key = cache.key(filename, None)
+            self.assertIsNone(cache.get(key))
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                g1 = GloList()
+                g1.import_files([filename], cache=cache)
+                g2 = GloList()
+                g2.import_files([filename], cache=cache)
+
+            self.assertIsNotNone(cache.get(key))
+            self.assertNotEqual(key, cache.key(filename, 2))
+            self.assertEqual(g2[0].export(), g1[0].export())
+            self.assertEqual(g2[0].render(), g1[0].render())
+            self.assertEqual(g2[0].get_duration(), 10)
+            self.assertNotIn('sub_cache', g2[0].__getstate__())
+
+            cache.max_size = 0
+            cache.put(key, g2)
+            self.assertIsNone(cache.get(key))
+
+    def test_file_cache_invalid(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = FileCache(directory)
+            # unsupported pickle protocol
+            with open(cache._path('key'), 'wb') as f:
+                f.write(zlib.compress(b'\x80\x09'))
+            self.assertIsNone(cache.get('key'))
+
+            # entries evicted by another process are skipped, no temporary files are left
+            cache.max_size = 0
+            with unittest.mock.patch.object(cache, '_entries', side_effect=lambda: FileCache._entries(cache) + [cache._path('gone')]):
+                cache.put('key', [1, 2, 3])
+            self.assertEqual(os.listdir(directory), [])
+
+            if hasattr(os, 'getuid'):
+                os.chmod(directory, 0o777)
+                with contextlib.redirect_stdout(io.StringIO()) as output:
+                    self.assertRaises(ValueError, FileCache, directory)
+                self.assertEqual(output.getvalue(), f"ERROR: cache directory '{directory}' must be owned by the current user and not writable by others\n")
+
+
+class Test_color_row(unittest.TestCase):
+    row = [1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 2, 2, 2, 2, 2, 3, 3, 3]
+
+    def test_color_row_to_colors(self):
+        o = GloList._color_row_to_colors(GloList(), self.row)
+        self.assertEqual([c.export() for c in o], ['color (1, 1, 1)', 'delay (2)', 'color (2, 2, 2)', 'delay (3)', 'color (3, 3, 3)', 'delay (1)'])
+
+    def test_color_row_to_ramps(self):
+        o = GloList._color_row_to_ramps(GloList(), self.row)
+        self.assertEqual([c.export() for c in o], ['color (1, 1, 1)', 'ramp (1, 1, 1, 1)', 'ramp (2, 2, 2, 1)', 'ramp (2, 2, 2, 2)', 'ramp (3, 3, 3, 1)', 'ramp (3, 3, 3, 1)'])
+        o = GloList._color_row_to_ramps(GloList(), self.row[0: 3])
+        self.assertEqual([c.export() for c in o], ['color (1, 1, 1)', 'ramp (1, 1, 1, 1)'])
+
+    def test_color_row_to_fitted_ramps(self):
+        row = [v for n in range(11) for v in (10 * n, 0, 100 - 10 * n)] + [100, 0, 0] * 3 + [50, 50, 52]
+        o = GloList._color_row_to_fitted_ramps(None, row, 0)
+        self.assertEqual([c.export() for c in o], ['color (0, 0, 100)', 'ramp (100, 0, 0, 10)', 'ramp (100, 0, 0, 3)', 'ramp (50, 50, 52, 1)', 'ramp (50, 50, 52, 1)'])
+        o = GloList._color_row_to_fitted_ramps(None, row, 100)
+        self.assertEqual([c.export() for c in o], ['color (0, 0, 100)', 'ramp (50, 50, 52, 14)', 'ramp (50, 50, 52, 1)'])
 
 
 class Test_get_slices(unittest.TestCase):
@@ -350,6 +962,34 @@ class Test_get_slices(unittest.TestCase):
 
 
 class Test_compress(unittest.TestCase):
+    def test_compress_repair(self):
+        motif = ['color (255, 0, 0)', 'delay (10)', 'color (0, 0, 255)', 'delay (5)']
+        lines = motif * 3 + ['color (0, 255, 0)', 'delay (1)'] + motif + ['end']
+        f = GloList()._import_glo(lines)
+        colors = f.render()
+        f.get_main()._compress_repair(f)
+        self.assertEqual(f.render(), colors)
+        self.assertEqual([o.name for o in f.get_main()], ['loop', 'color', 'delay', 'sub'])
+        self.assertEqual([len(o) for o in f[1:]], [4])
+
+    def test_compress_repair_names(self):
+        motif = ['color (255, 0, 0)', 'delay (10)', 'color (0, 0, 255)', 'delay (5)']
+        lines = motif * 3 + ['color (0, 255, 0)', 'delay (1)'] + motif + ['end']
+        f = GloList()._import_glo(lines)
+        f.get_main()._compress_repair(f)
+        name = f[1].get_name()
+
+        # a different sub with the same name is kept, an equal one is used
+        f = GloList()._import_glo(lines + ['defsub (' + name + ')', 'delay (3)', 'endsub'])
+        colors = f.render()
+        f.get_main()._compress_repair(f)
+        self.assertEqual(f.render(), colors)
+        self.assertEqual([o.get_name() for o in f[1:]], [name, name + '_2'])
+        m = GloList()._import_glo(lines).get_main()
+        m._compress_repair(f)
+        self.assertEqual(len(f), 3)
+        self.assertEqual(m[-1].arguments, Arguments([name + '_2']))
+
     def test_compress_ramp_1(self):
         m1 = LightSequenceMain(objects=[
             LightCommandColor(arguments=Arguments([0, 0, 0])),
@@ -381,6 +1021,79 @@ class Test_compress(unittest.TestCase):
         m1.compress(options={'epsilon': 0, 'root': None})
         self.assertEqual(m1, m2)
 
+    def test_compress_ramp_greedy(self):
+        m1 = LightSequenceMain(objects=[
+            LightCommandColor(arguments=Arguments([0, 0, 0])),
+            LightCommandRamp(arguments=Arguments([85, 50, 20, 10])),
+            LightCommandRamp(arguments=Arguments([170, 100, 40, 10])),
+            LightCommandColor(arguments=Arguments([0, 0, 255])),
+            LightCommandDelay(arguments=Arguments([4])),
+            LightCommandColor(arguments=Arguments([0, 0, 200])),
+            LightCommandDelay(arguments=Arguments([5]))
+        ])
+        m1.compress(options={'epsilon': 0, 'root': None, 'ramp_algorithm': 'greedy'})
+        self.assertEqual([o.export() for o in m1], [
+            'color (0, 0, 0)', 'ramp (170, 100, 40, 20) ; COMPRESSED (e_max=0.00)', 'color (0, 0, 255)', 'delay (4)', 'color (0, 0, 200)', 'delay (5)'
+        ])
+        m1.compress(options={'epsilon': 55, 'root': None, 'ramp_algorithm': 'greedy'})
+        self.assertEqual([o.export() for o in m1[2:]], ['color (0, 0, 255)', 'ramp (0, 0, 200, 9) ; COMPRESSED (e_max=30.56)'])
+
+    def test_compress_ramp_partial_colors(self):
+        # the color of partial colors depends on the color before, they are not converted to ramps
+        lines = ['color (10, 20, 30)', 'delay (5)', 'color.red (100)', 'delay (4)', 'color (0, 0, 0)', 'delay (3)', 'end']
+        f = GloList()._import_glo(lines)
+        m = f.get_main()
+        m._convert_to_ramps()
+        self.assertEqual([o.export() for o in m], ['color (10, 20, 30)', 'ramp (10, 20, 30, 5)', 'color.red (100)', 'delay (4)', 'color (0, 0, 0)', 'ramp (0, 0, 0, 3)'])
+        f = GloList()._import_glo(lines)
+        with contextlib.redirect_stdout(io.StringIO()):
+            f.get_main().compress(options={'epsilon': 1000, 'root': f})
+        self.assertEqual(f.export(), '\n'.join(lines))
+
+    def test_compress_douglas_peucker_partial_colors(self):
+        m = LightSequenceMain(objects=[
+            LightCommandColor(arguments=Arguments([10, 20, 30])),
+            LightCommandColorRed(arguments=Arguments([100])),
+            LightCommandRamp(arguments=Arguments([0, 0, 0, 3]))
+        ])
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertRaises(ValueError, m._compress_douglas_peucker, 0, 2, 1)
+        self.assertEqual(output.getvalue(), 'ERROR: ramp compression of colors without all components\n')
+
+    def test_compress_ramp_long_delay(self):
+        # delays too long for a single ramp are kept
+        lines = ['color (10, 20, 30)', 'delay (100)', 'color (40, 50, 60)', 'delay (70000)', 'color (0, 0, 0)', 'delay (1)', 'color (10, 0, 0)', 'delay (1)', 'color (20, 0, 0)', 'delay (5)', 'end']
+        for algorithm in ('douglas-peucker', 'greedy'):
+            f = GloList()._import_glo(lines)
+            with contextlib.redirect_stdout(io.StringIO()):
+                f.get_main().compress(options={'epsilon': 1, 'root': f, 'ramp_algorithm': algorithm})
+            self.assertEqual([o.export() for o in f.get_main()], [
+                'color (10, 20, 30)', 'delay (100)', 'color (40, 50, 60)', 'delay (70000)', 'color (0, 0, 0)', 'ramp (20, 0, 0, 2) ; COMPRESSED (e_max=0.00)', 'delay (5)'
+            ])
+
+    def test_compress_ramp_greedy_bounded(self):
+        # a long noisy gradient keeps at most max_balls balls and stays within epsilon
+        rng = random.Random(0)
+        fitter = RampFitter(30)
+        fitter.append((0, 0, 0))
+        sizes = []
+        for i in range(2000):
+            fitter.append(tuple(min(255, max(0, i // 10 + rng.randint(-10, 10))) for _ in range(3)))
+            sizes.append(len(fitter.balls))
+        commands = fitter.finish()
+        self.assertLessEqual(max(sizes), RampFitter.max_balls)
+        self.assertLessEqual(fitter.error, 30)
+        self.assertLess(len(commands), 10)
+
+    def test_compress_ramp_long(self):
+        # deeper than the recursion limit
+        m1 = LightSequenceMain(objects=[LightCommandColor(arguments=Arguments([0, 0, 0]))] + [
+            LightCommandRamp(arguments=Arguments([i * 255 // 5000, 0, 0, 1])) for i in range(1, 5001)
+        ])
+        m1.compress(options={'epsilon': 1, 'root': None})
+        self.assertEqual([o.name for o in m1], ['color', 'ramp'])
+        self.assertEqual(m1[1].arguments, Arguments([255, 0, 0, 5000]))
+
 
 if __name__ == '__main__':
     unittest.main()